@@ -0,0 +1,128 @@
+# Zechy Wong
+# 20 May 2017
+# Code-switching parser
+# ---------------------
+# Batch parsing
+# - Parses whole corpora, one sentence per line, into JSON records
+# - The lexica are loaded once (when config is imported) and inherited by
+#   forked worker processes, which take sentences in chunks
+
+from __future__ import print_function, division
+
+import json
+import multiprocessing
+import time
+
+import config
+import app.lexical_array
+import app.parser
+import app.stats
+
+
+def parse_record(sentence, engine=None, max_parses=None, timeout=None,
+                 stats=False, deadline=None):
+    """
+    Parses a single sentence into a JSON-friendly record: The parses
+    (brackets plus structure), how many duplicate parses were dropped,
+    whether the sentence had any OOV items, whether it ran out of time, and
+    how long it took
+    :param sentence:
+    :param engine: As for app.parser.parse_string()
+    :param max_parses: As for app.parser.parse_string()
+    :param timeout: Time budget for this sentence, in seconds
+    :param stats: Include the app.stats.ParseStats for the sentence as well
+    :param deadline: Stop once time.time() passes this (e.g., for sentences
+        that share a time budget), whatever the timeout
+    :return:
+    """
+    start_time = time.time()
+    if timeout is not None:
+        deadline = min(deadline or float("inf"), start_time + timeout)
+
+    parse_stats = None
+    if stats:
+        parse_stats = app.stats.ParseStats()
+
+    lattices = []
+    deduplicator = app.parser.Deduplicator()
+    with app.stats.collecting(parse_stats):
+        found = list(app.parser.find_parses(sentence, engine, max_parses,
+                                            deadline,
+                                            deduplicator=deduplicator,
+                                            lattices=lattices))
+
+    parses = [{"brackets": parse.to_brackets(),
+               "structure": parse.to_dict()}
+              for parse in found]
+
+    record = {"sentence": sentence,
+              "parses": parses,
+              "duplicates": deduplicator.dropped,
+              "oov": lattices == [False] and
+              len(app.lexical_array.tokenise(sentence)) > 0,
+              "timed_out": deadline is not None and time.time() > deadline,
+              "time": time.time() - start_time}
+    if parse_stats is not None:
+        record["stats"] = parse_stats.to_dict()
+    return record
+
+
+def parse_record_task(task):
+    """
+    parse_record(), for worker processes: Takes a (sentence, options) tuple
+    :param task:
+    :return:
+    """
+    sentence, options = task
+    return parse_record(sentence, **options)
+
+
+def parse_batch(sentences, workers=1, chunk_size=64, **options):
+    """
+    Generates a parse record for each sentence, in order.
+    With more than one worker, the sentences are spread across a pool of
+    forked processes, `chunk_size` sentences at a time.
+    :param sentences:
+    :param workers:
+    :param chunk_size:
+    :param options: Passed on to parse_record()
+    :return:
+    """
+    tasks = ((sentence, options) for sentence in sentences)
+
+    if workers <= 1:
+        for task in tasks:
+            yield parse_record_task(task)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        # imap() keeps the results in the same order as the input
+        for record in pool.imap(parse_record_task, tasks, chunk_size):
+            yield record
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_batch(in_file, out_file, workers=1, chunk_size=64, **options):
+    """
+    Parses every non-blank line of `in_file` and writes one JSON record per
+    line to `out_file`
+    Returns the number of sentences parsed
+    :param in_file:
+    :param out_file:
+    :param workers:
+    :param chunk_size:
+    :param options: Passed on to parse_record()
+    :return:
+    """
+    sentences = (line.strip() for line in in_file if line.strip())
+
+    count = 0
+    for record in parse_batch(sentences, workers, chunk_size, **options):
+        out_file.write(json.dumps(record, sort_keys=True))
+        out_file.write("\n")
+        count += 1
+
+    return count
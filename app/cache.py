@@ -0,0 +1,187 @@
+# Zechy Wong
+# 16 May 2017
+# Code-switching parser
+# ---------------------
+# Bounded caches for the various lookup tables used while parsing
+# - Safe to share between threads (e.g., the workers of a thread-based
+#   app.parallel.ParseExecutor): Every operation holds the cache's lock
+
+import sys
+import threading
+from collections import OrderedDict
+
+# Marker for keys that aren't in a cache
+missing = object()
+
+
+class LRUCache:
+    """
+    A dictionary that holds on to at most `max_size` entries, evicting the
+    least recently used one when it fills up.
+    Keeps count of hits and misses, so we can tell if it's pulling its weight.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under `key` (marking it as recently used), or
+        `default` if there isn't one
+        :param key:
+        :param default:
+        :return:
+        """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache `value` under `key`, evicting old entries if necessary
+        :param key:
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def entry_size(key, value):
+    """
+    Rough number of bytes that a cache entry takes up: The key and value
+    objects themselves (not anything they refer to), plus the dictionary
+    slot
+    :param key:
+    :param value:
+    :return:
+    """
+    return sys.getsizeof(key) + sys.getsizeof(value) + 64
+
+
+class SizedLRU:
+    """
+    A cache that holds on to at most (roughly) `max_bytes` worth of entries,
+    as measured by `sizeof(key, value)`, throwing out the least recently
+    used ones first.
+    Recency is tracked by generation rather than per entry: New and recently
+    used entries go in the current generation, and when that fills up half
+    the budget, it becomes the old generation and the previous old
+    generation is thrown out wholesale.  Hits in the old generation move
+    the entry back into the current one.  This keeps lookups down to a
+    dictionary read or two, which matters for caches on the hot path.
+    Keeps count of hits and misses, like LRUCache.
+    """
+
+    def __init__(self, max_bytes, sizeof=entry_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.current = {}
+        self.current_bytes = 0
+        self.old = {}
+        self.old_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.current) + len(self.old)
+
+    def __contains__(self, key):
+        return key in self.current or key in self.old
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under `key` (marking it as recently used), or
+        `default` if there isn't one
+        :param key:
+        :param default:
+        :return:
+        """
+        with self.lock:
+            value = self.current.get(key, missing)
+            if value is missing:
+                value = self.old.pop(key, missing)
+                if value is missing:
+                    self.misses += 1
+                    return default
+                self.old_bytes -= self.sizeof(key, value)
+                self.store(key, value)
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache `value` under `key`, starting a new generation if the current
+        one is full
+        :param key:
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.store(key, value)
+
+    def store(self, key, value):
+        """
+        put(), for callers that already hold the lock
+        :param key:
+        :param value:
+        :return:
+        """
+        if key in self.current:
+            self.current_bytes -= self.sizeof(key, self.current[key])
+        self.current[key] = value
+        self.current_bytes += self.sizeof(key, value)
+
+        if self.current_bytes > self.max_bytes // 2:
+            self.old = self.current
+            self.old_bytes = self.current_bytes
+            self.current = {}
+            self.current_bytes = 0
+
+    @property
+    def size(self):
+        """
+        Rough number of bytes held
+        :return:
+        """
+        return self.current_bytes + self.old_bytes
+
+    def clear(self):
+        with self.lock:
+            self.current = {}
+            self.current_bytes = 0
+            self.old = {}
+            self.old_bytes = 0
+            self.hits = 0
+            self.misses = 0
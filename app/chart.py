@@ -0,0 +1,349 @@
+# coding=utf-8
+# Zechy Wong
+# 14 May 2017
+# Code-switching parser
+# ---------------------
+# Chart parser
+# - An alternative to the SO-by-SO scan in app.parser.check_parse()
+# - Keeps a chart of the constituents built over each span of a lexical
+#   lattice, using the same subcat_match() and merge() rules as the scan
+# - Reads the lattice directly, so material shared between lexical arrays is
+#   only processed once
+# - Constituents over the same span with the same signature (i.e.,
+#   constituents that the rest of the parse cannot tell apart) are packed into
+#   a single chart edge, so each span/category pair is only built once
+# - The filled chart can also be handed back as it is, as a packed forest
+#   (see app.forest)
+
+from __future__ import print_function
+
+import time
+from collections import deque
+
+import app.forest
+import app.parser
+import app.stats
+from app.subcat import compile_criteria
+
+# Index key for "every category"
+any_category = object()
+
+
+def chart_parse(lattice, deadline=None):
+    """
+    Parse every lexical array in the given LexicalLattice at once by filling
+    in a chart of constituents, bottom-up.
+    Generates every complete parse in the chart
+    If the deadline passes while the chart is being filled, only the parses
+    completed so far are generated
+    :param lattice:
+    :param deadline: Stop building constituents once time.time() passes this
+    :return:
+    """
+    chart = fill_chart(lattice, deadline)
+    for parse in chart.parses(0, lattice.length):
+        yield parse
+
+
+def chart_forest(lattice, deadline=None):
+    """
+    As for chart_parse(), but returns the complete parses as a packed
+    app.forest.PackedForest instead of generating them one by one
+    :param lattice:
+    :param deadline:
+    :return:
+    """
+    chart = fill_chart(lattice, deadline)
+    return app.forest.PackedForest(chart, 0, lattice.length)
+
+
+def fill_chart(lattice, deadline=None):
+    """
+    Put the SOs in the given LexicalLattice on a new chart, and fill it in
+    :param lattice:
+    :param deadline: Stop building constituents once time.time() passes this
+    :return:
+    """
+    chart = Chart()
+    for start, end, so in lattice.edges():
+        chart.add_leaf(start, end, so)
+    with app.stats.stage("chart_fill"):
+        chart.fill(deadline)
+    return chart
+
+
+def signature(so):
+    """
+    Everything about an SO that the rest of the parse can see: subcat_match()
+    looks at the category, label and features, merge() looks at the subcat
+    list and the last phase lexicon.
+    Constituents with the same signature over the same span can be packed
+    together.
+    (SOs on the chart are all frozen, so their features and subcat criteria
+    can be compared directly)
+    :param so:
+    :return:
+    """
+    return (so.category,
+            so.label,
+            so.features,
+            so.subcat,
+            frozenset(so.last_phase_lexicon()))
+
+
+def insert(index, node, category, edge):
+    """
+    Add an edge to one of the chart indices, under its own category and under
+    any_category
+    :param index:
+    :param node:
+    :param category:
+    :param edge:
+    :return:
+    """
+    index.setdefault((node, category), []).append(edge)
+    index.setdefault((node, any_category), []).append(edge)
+
+
+def lookup(index, node, category):
+    """
+    Find the edges in one of the chart indices that could go with the given
+    category: Those with the same category, and those with no category at
+    all (None matches anything).
+    :param index:
+    :param node:
+    :param category:
+    :return:
+    """
+    if category is None:
+        return index.get((node, any_category), [])
+
+    return index.get((node, category), []) + index.get((node, None), [])
+
+
+class Edge:
+    def __init__(self, start, end, so):
+        # The span covered by this edge
+        self.start = start
+        self.end = end
+
+        # Representative SO: Every constituent packed into this edge matches
+        # and merges the same way, so we only ever need to check this one
+        self.so = so
+
+        # Ways of building this edge: (head, complement, head_direction) tuples
+        # Lexical (leaf) edges have none
+        self.derivations = []
+
+        # Order in which the edge was added to the chart
+        self.serial = 0
+
+
+class Chart:
+    def __init__(self):
+        # (start, end) -> {signature: Edge}, for constituents built by merging
+        self.cells = {}
+
+        # Edges that have been processed, indexed so that "who next to me
+        # could take me?" is a lookup rather than a scan:
+        # Heads by the node they look out from and the category they look for
+        # (None if they will take anything)
+        self.right_heads = {}
+        self.left_heads = {}
+        # Complements (edges that don't subcategorise) by the node they start
+        # or end at and their category
+        self.complements_starting = {}
+        self.complements_ending = {}
+
+        # Edges that still need to be combined with their neighbours
+        self.agenda = deque()
+        self.edge_count = 0
+
+    def add_leaf(self, start, end, so):
+        """
+        Put a lexical SO on the chart. Leaves are never packed (they are what
+        tell the final parses apart), so they don't need a cell.
+        :param start:
+        :param end:
+        :param so:
+        :return:
+        """
+        edge = Edge(start, end, so)
+        self.agenda.append(edge)
+        return edge
+
+    def fill(self, deadline=None):
+        """
+        Run through the agenda until no new constituents can be built.
+        Each edge is only indexed once it is processed, so every pair of
+        neighbouring edges is tried exactly once.
+        :param deadline: Give up once time.time() passes this
+        :return:
+        """
+        while self.agenda:
+            if deadline is not None and time.time() > deadline:
+                return
+
+            self.combine(self.agenda.popleft())
+
+    def combine(self, edge):
+        """
+        Try to merge an edge with all its (processed) neighbours, in the same
+        way that app.parser.check_parse() would: The head looks for its first
+        subcategorisation on the appropriate side, and the complement must not
+        be looking for anything itself.
+        Then index the edge, so that later edges can find it.
+        :param edge:
+        :return:
+        """
+        so = edge.so
+        stats = app.stats.active
+
+        if len(so.subcat) > 0:
+            # A head: Look for complements in the direction of its first
+            # subcategorisation
+            direction, criteria = so.subcat[0]
+            matcher = compile_criteria(criteria)
+            if direction == "right":
+                complements = lookup(self.complements_starting, edge.end,
+                                     criteria.category)
+                for complement in complements:
+                    if matcher.matches(complement.so):
+                        self.add_merge(head=edge,
+                                       complement=complement,
+                                       head_direction="left")
+                insert(self.right_heads, edge.end, criteria.category, edge)
+            elif direction == "left":
+                complements = lookup(self.complements_ending, edge.start,
+                                     criteria.category)
+                for complement in complements:
+                    if matcher.matches(complement.so):
+                        self.add_merge(head=edge,
+                                       complement=complement,
+                                       head_direction="right")
+                insert(self.left_heads, edge.start, criteria.category, edge)
+            else:
+                complements = []
+
+            if stats is not None:
+                stats.subcat_matches += len(complements)
+        else:
+            # A complement: Look for heads on either side that want it
+            right_heads = lookup(self.right_heads, edge.start, so.category)
+            for head in right_heads:
+                if compile_criteria(head.so.subcat[0][1]).matches(so):
+                    self.add_merge(head=head,
+                                   complement=edge,
+                                   head_direction="left")
+            left_heads = lookup(self.left_heads, edge.end, so.category)
+            for head in left_heads:
+                if compile_criteria(head.so.subcat[0][1]).matches(so):
+                    self.add_merge(head=head,
+                                   complement=edge,
+                                   head_direction="right")
+            insert(self.complements_starting, edge.start, so.category, edge)
+            insert(self.complements_ending, edge.end, so.category, edge)
+
+            if stats is not None:
+                stats.subcat_matches += len(right_heads) + len(left_heads)
+
+    def add_merge(self, head, complement, head_direction):
+        """
+        Merge the representative SOs of two edges and put the result on the
+        chart, packing it with any existing edge that has the same signature
+        :param head:
+        :param complement:
+        :param head_direction:
+        :return:
+        """
+        parent = app.parser.merge(head=head.so,
+                                  complement=complement.so,
+                                  head_direction=head_direction,
+                                  new_subcat=head.so.subcat[1:])
+        if not parent:
+            return
+
+        if head_direction == "left":
+            start, end = head.start, complement.end
+        else:
+            start, end = complement.start, head.end
+
+        derivation = (head, complement, head_direction)
+        cell = self.cells.get((start, end))
+        if cell is None:
+            cell = {}
+            self.cells[(start, end)] = cell
+
+        key = signature(parent)
+        if key in cell:
+            cell[key].derivations.append(derivation)
+        else:
+            edge = Edge(start, end, parent)
+            edge.derivations.append(derivation)
+            cell[key] = edge
+            self.agenda.append(edge)
+            # Keep track of the order edges came in, for the final parses
+            self.edge_count += 1
+            edge.serial = self.edge_count
+
+    def parses(self, start, end):
+        """
+        Generate the complete parses over the given span, unpacking them one
+        at a time.
+        Like app.parser.check_parse(), only SOs that were built up by merging
+        count as parses.
+        :param start:
+        :param end:
+        :return:
+        """
+        unpacked = {}
+        for edge in sorted(self.cells.get((start, end), {}).values(),
+                           key=lambda goal: goal.serial):
+            for head, complement, head_direction in edge.derivations:
+                for head_so in self.unpack(head, unpacked):
+                    for complement_so in self.unpack(complement, unpacked):
+                        yield self.rebuild(head_so, complement_so,
+                                           head_direction)
+
+    def unpack(self, edge, unpacked):
+        """
+        Recursively expand a packed edge into the full list of SOs that it
+        represents
+        :param edge:
+        :param unpacked: Edges that have already been expanded
+        :return:
+        """
+        if edge in unpacked:
+            return unpacked[edge]
+
+        if len(edge.derivations) == 0:
+            unpacked[edge] = [edge.so]
+            return unpacked[edge]
+
+        trees = []
+        for head, complement, head_direction in edge.derivations:
+            for head_so in self.unpack(head, unpacked):
+                for complement_so in self.unpack(complement, unpacked):
+                    trees.append(self.rebuild(head_so, complement_so,
+                                              head_direction))
+
+        unpacked[edge] = trees
+        return trees
+
+    @staticmethod
+    def rebuild(head_so, complement_so, head_direction):
+        """
+        Merge one particular head/complement pair out of two packed edges.
+        Every SO in an edge merges the same way as its representative, so
+        this cannot fail
+        :param head_so:
+        :param complement_so:
+        :param head_direction:
+        :return:
+        """
+        parent = app.parser.merge(head=head_so,
+                                  complement=complement_so,
+                                  head_direction=head_direction,
+                                  new_subcat=head_so.subcat[1:])
+        assert parent
+        return parent
@@ -0,0 +1,245 @@
+# Zechy Wong
+# 31 May 2017
+# Code-switching parser
+# ---------------------
+# Packed parse forests
+# - An alternative to a list of full parse trees, for ambiguous input: The
+#   packed edges of a filled chart (see app.chart), where each constituent
+#   is stored once however many parses share it, and each way of building
+#   it is an alternative under a single OR-node
+# - The individual trees are only built when asked for, by position: They
+#   can be counted, paged through, or sampled (uniformly) without unpacking
+#   the rest
+# - Trees come out in the same order that app.chart.chart_parse() generates
+#   them in
+
+from __future__ import print_function
+
+import random
+
+import app.chart
+
+
+class PackedForest:
+    """
+    Every complete parse over one span of a chart, packed
+    """
+
+    def __init__(self, chart, start, end):
+        """
+        :param chart: A filled app.chart.Chart
+        :param start:
+        :param end:
+        """
+        self.chart = chart
+
+        # The OR-node at the top: One goal edge per distinct signature over
+        # the whole span, each with its own alternatives
+        self.roots = sorted(chart.cells.get((start, end), {}).values(),
+                            key=lambda goal: goal.serial)
+
+        # Edge -> the number of trees under it, worked out as needed
+        self.counts = {}
+
+    def count(self, edge=None):
+        """
+        The number of trees in the forest, or under one of its edges.
+        Every way of building a tree counts, so this includes trees that
+        app.parser.Deduplicator would drop as structurally identical to
+        another (e.g., built with different subcat lists)
+        :param edge:
+        :return:
+        """
+        if edge is None:
+            return sum(self.count(root) for root in self.roots)
+
+        if edge in self.counts:
+            return self.counts[edge]
+
+        if len(edge.derivations) == 0:
+            total = 1
+        else:
+            total = 0
+            for head, complement, _ in edge.derivations:
+                total += self.count(head) * self.count(complement)
+
+        self.counts[edge] = total
+        return total
+
+    def __iter__(self):
+        """
+        Generate every tree in the forest, one at a time
+        :return:
+        """
+        for root in self.roots:
+            for derivation in root.derivations:
+                for tree in self.unpack_derivation(derivation):
+                    yield tree
+
+    def unpack(self, edge):
+        """
+        Generate every tree under an edge, one at a time (without keeping
+        them)
+        :param edge:
+        :return:
+        """
+        if len(edge.derivations) == 0:
+            yield edge.so
+            return
+
+        for derivation in edge.derivations:
+            for tree in self.unpack_derivation(derivation):
+                yield tree
+
+    def unpack_derivation(self, derivation):
+        head, complement, head_direction = derivation
+        for head_so in self.unpack(head):
+            for complement_so in self.unpack(complement):
+                yield app.chart.Chart.rebuild(head_so, complement_so,
+                                              head_direction)
+
+    def tree(self, index):
+        """
+        Build the tree at the given position (as for a list, negative
+        positions count from the end)
+        :param index:
+        :return:
+        """
+        total = self.count()
+        if index < 0:
+            index += total
+        if index < 0 or index >= total:
+            raise IndexError("No tree {} in a forest of {}".format(index,
+                                                                   total))
+
+        for root in self.roots:
+            root_count = self.count(root)
+            if index < root_count:
+                return self.build(root, index)
+            index -= root_count
+
+    def build(self, edge, index):
+        """
+        Build the tree at the given position under an edge.
+        The trees under each alternative follow on from those under the one
+        before, and within an alternative, every complement is tried with
+        the first head before moving on to the next head (as in __iter__())
+        :param edge:
+        :param index:
+        :return:
+        """
+        if len(edge.derivations) == 0:
+            return edge.so
+
+        for head, complement, head_direction in edge.derivations:
+            complement_count = self.count(complement)
+            derivation_count = self.count(head) * complement_count
+            if index < derivation_count:
+                head_index, complement_index = divmod(index,
+                                                      complement_count)
+                return app.chart.Chart.rebuild(
+                    self.build(head, head_index),
+                    self.build(complement, complement_index),
+                    head_direction)
+            index -= derivation_count
+
+    def page(self, offset=0, limit=10):
+        """
+        The trees at positions offset to offset + limit - 1 (or fewer, at the
+        end of the forest)
+        :param offset:
+        :param limit:
+        :return:
+        """
+        end = min(offset + limit, self.count())
+        trees = []
+        index = offset
+        while index < end:
+            trees.append(self.tree(index))
+            index += 1
+        return trees
+
+    def sample(self, size=1, rng=None):
+        """
+        Pick distinct trees from the forest uniformly at random (all of them,
+        in random order, if it doesn't have `size` trees)
+        :param size:
+        :param rng: random.Random instance to draw from (default: the random
+            module's own)
+        :return:
+        """
+        if rng is None:
+            rng = random
+
+        total = self.count()
+        size = min(size, total)
+        if size * 2 > total:
+            # Most of the forest anyway: Shuffle the lot
+            indices = list(range(total))
+            rng.shuffle(indices)
+            indices = indices[:size]
+        else:
+            indices = []
+            seen = set()
+            while len(indices) < size:
+                index = rng.randrange(total)
+                if index not in seen:
+                    seen.add(index)
+                    indices.append(index)
+
+        return [self.tree(index) for index in indices]
+
+    def nodes(self):
+        """
+        The edges that make up the forest (not counting lexical leaves),
+        from the bottom up
+        :return:
+        """
+        found = set()
+        pending = list(self.roots)
+        while pending:
+            edge = pending.pop()
+            if edge in found or len(edge.derivations) == 0:
+                continue
+            found.add(edge)
+            for head, complement, _ in edge.derivations:
+                pending.append(head)
+                pending.append(complement)
+
+        # Edges only ever derive from edges that came before them
+        return sorted(found, key=lambda edge: edge.serial)
+
+    def to_brackets(self):
+        """
+        Returns the forest in bracket notation, one line per shared
+        constituent: Each one is given a number (#n) and written out once,
+        with its alternatives separated by '|', and lexical items are written
+        out in full wherever they appear.  The last line lists the parses.
+        :return:
+        """
+        nodes = self.nodes()
+        names = dict((edge, "#{}".format(idx))
+                     for idx, edge in enumerate(nodes, 1))
+
+        def name(edge):
+            if edge in names:
+                return names[edge]
+            return edge.so.to_brackets()
+
+        def alternatives(edge):
+            written = []
+            for head, complement, head_direction in edge.derivations:
+                if head_direction == "left":
+                    children = (head, complement)
+                else:
+                    children = (complement, head)
+                written.append("[{} {}]".format(
+                    edge.so.label, " ".join(name(child)
+                                            for child in children)))
+            return " | ".join(written)
+
+        lines = ["{} {}".format(names[edge], alternatives(edge))
+                 for edge in nodes]
+        lines.append("Parses: {}".format(
+            " | ".join(names[root] for root in self.roots)))
+        return "\n".join(lines)
@@ -5,45 +5,183 @@
 # Class for dealing with raw input and turning them into lexical items (i.e.,
 # syntactic objects)
 
-import itertools
 import string
 
 import config
+import app.stats
 
 
 def enumerate_input(user_input):
     """
     Given some input from the user, possibly an incomplete sentence, 
     attempt to tokenise and identify relevant lexical items from the 
-    lexicons, then generate all possible combinations of the SOs retrieved
+    lexicons, then arrange the SOs retrieved into a lattice that covers all
+    their possible combinations
+    Returns False on OOV items
     :param user_input: 
     :return: 
     """
     # Start by tokenising
-    tokens = tokenise(user_input)
+    with app.stats.stage("tokenise"):
+        tokens = tokenise(user_input)
 
     # Look up the tokens in the available lexica
-    mapped_tokens = lookup_tokens(tokens)
+    with app.stats.stage("lookup_tokens"):
+        mapped_tokens = lookup_tokens(tokens)
     if not mapped_tokens:
         # Probably an OOV item
         return False
 
-    # Generate combinations of possible parses
-    raw_parse_arrays = [list(x) for x in itertools.product(*mapped_tokens)]
+    return LexicalLattice(len(tokens), mapped_tokens)
 
-    # Each array in parse_arrays is currently 2D, where SOs are chunked
-    # by how they were mapped to individual lexica.  Flatten it to a 1D
-    # array of SOs.
-    parse_arrays = []
-    for raw_parse_array in raw_parse_arrays:
-        this_array = []
-        for chunked_array in raw_parse_array:
-            # Flatten by extending `this_array`
-            this_array += chunked_array
 
-        parse_arrays.append(this_array)
+class LexicalLattice:
+    """
+    A compact representation of every lexical array that some input could
+    map to.
+    There is one slot per (possibly multi-word) token, holding the
+    alternative SO sequences that token could be realised as.  Slots are
+    anchored to the positions of the words they cover, and may overlap when
+    the input can be segmented in more than one way.
+    Each lexical array is one path through the lattice, picking one slot at
+    each position and one alternative per slot.
+    """
+
+    def __init__(self, length, slots):
+        # Number of words in the input
+        self.length = length
+
+        # Each slot is a (start, end, alternatives) tuple: It covers words
+        # start to end - 1, and each alternative is a sequence of SOs
+        self.slots = slots
+
+        # Slots by the position they start at, longest first
+        self.starting_at = {}
+        for slot in sorted(slots, key=lambda item: item[0] - item[1]):
+            self.starting_at.setdefault(slot[0], []).append(slot)
+
+    def count(self):
+        """
+        The number of distinct lexical arrays in the lattice
+        :return:
+        """
+        # Number of paths from each position to the end
+        paths = {self.length: 1}
+        for position in reversed(range(self.length)):
+            paths[position] = sum(len(alternatives) * paths.get(end, 0)
+                                  for start, end, alternatives
+                                  in self.starting_at.get(position, []))
+        return paths[0] if self.length > 0 else 0
+
+    def combinations(self):
+        """
+        Generates each lexical array in the lattice in turn, as a flat list of
+        SOs: Longer segmentations first, then in the same order as
+        itertools.product() would.
+        Flattened prefixes are shared by every array that starts with them,
+        so they are only built once.
+        :return:
+        """
+        if self.length == 0:
+            return
+
+        # Depth-first, with our own stack: (position, flattened prefix)
+        stack = [(0, ())]
+        while stack:
+            position, prefix = stack.pop()
+            if position == self.length:
+                # Callers are free to consume the array they are given
+                yield list(prefix)
+                continue
+
+            # Pushed in reverse, so that they come off in order
+            for start, end, alternatives in reversed(
+                    self.starting_at.get(position, [])):
+                for alternative in reversed(alternatives):
+                    stack.append((end, prefix + tuple(alternative)))
+
+    def edges(self):
+        """
+        Lays the lattice out as a graph of SOs, for parsers that read it
+        directly: Nodes 0 to `length` are the positions between words, and
+        any alternative made up of more than one SO gets its own internal
+        nodes after those.
+        Returns a list of (start, end, SO) tuples
+        :return:
+        """
+        edges = []
+        next_node = self.length + 1
+        for slot_start, slot_end, alternatives in self.slots:
+            for alternative in alternatives:
+                start = slot_start
+                for so_idx, so in enumerate(alternative):
+                    if so_idx == len(alternative) - 1:
+                        end = slot_end
+                    else:
+                        end = next_node
+                        next_node += 1
+                    edges.append((start, end, so))
+                    start = end
+
+        return edges
+
+
+class TokenTrie:
+    """
+    A trie of the multi-word tokens across a set of lexica, so that every
+    multi-word token starting at some point in the input can be found in one
+    pass.
+    (Single-word tokens are looked up in the lexica directly)
+    """
 
-    return parse_arrays
+    def __init__(self, lexica):
+        self.lexica = list(lexica)
+
+        # Nested dictionaries, one level per word.  The full token is kept
+        # under the None key of the node where it ends.
+        self.root = {}
+        for lexicon in self.lexica:
+            for token in lexicon.multiword_tokens():
+                node = self.root
+                for word in token.split():
+                    node = node.setdefault(word, {})
+                node[None] = token
+
+    def matches(self, tokens, start):
+        """
+        Finds every multi-word token that starts at tokens[start]
+        Returns a list of (end, token) tuples
+        :param tokens:
+        :param start:
+        :return:
+        """
+        found = []
+        node = self.root
+        for end in range(start, len(tokens)):
+            node = node.get(tokens[end])
+            if node is None:
+                break
+            if None in node and end > start:
+                found.append((end + 1, node[None]))
+        return found
+
+
+# Trie for the current config.lexica, built when first needed
+token_trie = None
+
+
+def get_token_trie():
+    """
+    Returns the TokenTrie for config.lexica, rebuilding it if the set of
+    lexica has changed
+    :return:
+    """
+    global token_trie
+    if token_trie is None or len(token_trie.lexica) != len(config.lexica) or \
+            any(old is not new
+                for old, new in zip(token_trie.lexica, config.lexica)):
+        token_trie = TokenTrie(config.lexica)
+    return token_trie
 
 
 def tokenise(input_string):
@@ -59,47 +197,55 @@ def tokenise(input_string):
     return input_string.lower().translate(None, remove_punct).split()
 
 
-def lookup_tokens(tokens, mapped=None):
+def lookup_tokens(tokens):
     """
-    Recursively searches the available lexica for all the possible SOs 
-    that we could map tokens to.
+    Searches the available lexica for all the possible SOs that we could map
+    tokens to, in a single pass over the input.
+    Every segmentation of the input is kept: A multi-word token in one
+    lexicon can overlap with single words in another.
     Returns False on OOV items
-    Elsewise returns a list of lists of SOs, where the top-level list 
-    represents tokens and the lower-level list represents possible SOs for 
-    each token
+    Elsewise returns a list of slots: (start, end, entries) tuples, where
+    `entries` is the list of possible SO sequences for tokens[start:end]
     :param tokens: 
-    :param mapped: 
     :return: 
     """
-    if mapped is None:
-        mapped = []
-
-    # Base case
-    if not tokens:
-        return mapped
-
-    # Start by taking the longest possible remaining token string
-    for length in reversed(range(len(tokens))):
-        token = " ".join(tokens[:length + 1])
-
-        possible_entries = []
-
-        # Get the possible entries from each lexicon
-        # TODO: Cases where one lexicon has a multi-word entry that
-        # TODO: overlaps with single words of another lexicon
-        for lexicon in config.lexica:
-            entry = lexicon.lookup_token(token)
-            if entry:
-                # Lexicons already return lists of possible entries,
-                # which are themselves lists of SOs. We can extend
-                # `possible_entries` instead of appending to it
-                possible_entries += entry
-
-        if len(possible_entries) == 0:
-            if length == 0:
-                # OOV
-                print("Out of Vocabulary: {}".format(token))
-                return False
-        else:
-            mapped.append(possible_entries)
-            return lookup_tokens(tokens[length + 1:], mapped)
+    trie = get_token_trie()
+
+    # Get the possible entries at each position, from each lexicon
+    slots = []
+    for start in range(len(tokens)):
+        candidates = [(start + 1, tokens[start])] + trie.matches(tokens,
+                                                                 start)
+        for end, token in candidates:
+            possible_entries = []
+            for lexicon in config.lexica:
+                entry = lexicon.lookup_token(token)
+                if entry:
+                    # Lexicons already return lists of possible entries,
+                    # which are themselves sequences of SOs. We can extend
+                    # `possible_entries` instead of appending to it
+                    possible_entries += entry
+
+            if len(possible_entries) > 0:
+                slots.append((start, end, possible_entries))
+
+    # Only keep the slots that are on some path through the whole input
+    reachable = {0}
+    for start, end, possible_entries in slots:
+        if start in reachable:
+            reachable.add(end)
+
+    finishing = {len(tokens)}
+    for start, end, possible_entries in reversed(slots):
+        if end in finishing:
+            finishing.add(start)
+
+    if len(tokens) not in reachable:
+        # OOV: Report the first word we can't get past
+        stuck = max(position for position in reachable
+                    if position < len(tokens))
+        print("Out of Vocabulary: {}".format(tokens[stuck]))
+        return False
+
+    return [slot for slot in slots
+            if slot[0] in reachable and slot[1] in finishing]
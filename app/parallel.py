@@ -0,0 +1,184 @@
+# Zechy Wong
+# 22 May 2017
+# Code-switching parser
+# ---------------------
+# Parallel checking of lexical arrays
+# - The lexical arrays for a single sentence are independent of each other,
+#   so check_parse() can be run over them in parallel
+# - Opt-in: Create a ParseExecutor and hand it to app.parser.parse_string()
+# - Thread workers share the parser's tables: The FrozenSO hash-cons table,
+#   the ID and feature bit tables and the caches all take a lock before
+#   adding anything, so structurally identical SOs are still always the same
+#   object
+
+from __future__ import print_function, division
+
+import multiprocessing
+import sys
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import app.parser
+
+# Shared with the pool workers (see ParseExecutor): The highest generation
+# (i.e., sentence) that has been called off
+cancelled_generation = None
+
+
+def free_threaded():
+    """
+    Are we running on an interpreter without a GIL? If so, threads are just
+    as good as processes, and much cheaper
+    :return:
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def init_worker(cancelled):
+    """
+    Pool initialiser: Hang on to the shared cancellation counter
+    :param cancelled:
+    :return:
+    """
+    global cancelled_generation
+    cancelled_generation = cancelled
+
+
+def check_chunk(task):
+    """
+    Runs check_parse() over a chunk of lexical arrays, returning the parses
+    that survived, in order.
+    Gives up early if the sentence is called off or the deadline passes.
+    :param task: (generation, lexical arrays, deadline) tuple
+    :return:
+    """
+    generation, parse_combos, deadline = task
+    parses = []
+    for parse_combo in parse_combos:
+        if cancelled_generation.value >= generation:
+            break
+        if deadline is not None and time.time() > deadline:
+            break
+
+        parse = app.parser.check_parse(left=[], right=parse_combo)
+        if parse:
+            parses.append(parse)
+
+    return parses
+
+
+class ParseExecutor:
+    """
+    A pool of workers for checking the lexical arrays of a single sentence in
+    parallel.
+    Uses processes by default, or threads on a free-threaded interpreter.
+    The pool is kept around between sentences; close() it when done (or use
+    it as a context manager).
+    """
+
+    def __init__(self, workers=None, kind=None, chunk_size=16, window=None):
+        """
+        :param workers: Number of workers (default: one per CPU)
+        :param kind: (process|thread) Default: thread if free_threaded()
+        :param chunk_size: Lexical arrays handed to a worker at a time
+        :param window: Chunks handed out but not yet collected, at most
+            (default: two per worker)
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if kind is None:
+            kind = "thread" if free_threaded() else "process"
+        if window is None:
+            window = 2 * workers
+
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.window = window
+
+        # Each sentence gets a new generation number; calling a sentence off
+        # raises the shared counter to its generation, which tells the
+        # workers to skip anything that is still queued for it
+        self.generation = 0
+        self.cancelled = multiprocessing.Value("i", 0)
+
+        if kind == "process":
+            self.pool = multiprocessing.Pool(workers, init_worker,
+                                             (self.cancelled,))
+        elif kind == "thread":
+            self.pool = ThreadPool(workers, init_worker, (self.cancelled,))
+        else:
+            raise ValueError("Unknown executor kind: {}".format(kind))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def scan_parse(self, lattice, deadline=None):
+        """
+        As app.parser.scan_parse(), but with the lexical arrays split into
+        chunks across the workers.
+        Parses are generated in the same order as scan_parse() would, and
+        once the caller stops asking for more (e.g., because max_parses has
+        been reached), the rest of the sentence is called off.
+        The chunks are made (and prefiltered) here, in the calling thread,
+        and only `window` of them are handed out ahead of the one being
+        collected, so calling the sentence off stops the enumeration too.
+        :param lattice:
+        :param deadline: Stop looking for parses once time.time() passes this
+        :return:
+        """
+        self.generation += 1
+        generation = self.generation
+        chunks = self.chunks(lattice, generation, deadline)
+
+        # Results for the chunks handed out so far, oldest first
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < self.window:
+                    task = next(chunks, None)
+                    if task is None:
+                        break
+                    pending.append(self.pool.apply_async(check_chunk,
+                                                         (task,)))
+                if len(pending) == 0:
+                    return
+
+                for parse in pending.popleft().get():
+                    yield parse
+        finally:
+            with self.cancelled.get_lock():
+                self.cancelled.value = max(self.cancelled.value, generation)
+
+    def chunks(self, lattice, generation, deadline):
+        """
+        Generates the tasks for check_chunk() as they are handed out,
+        stopping as soon as the sentence is called off or the deadline
+        passes
+        :param lattice:
+        :param generation:
+        :param deadline:
+        :return:
+        """
+        chunk = []
+        for parse_combo in app.parser.feasible_combinations(lattice):
+            if self.cancelled.value >= generation:
+                return
+            if deadline is not None and time.time() > deadline:
+                break
+
+            chunk.append(parse_combo)
+            if len(chunk) == self.chunk_size:
+                yield (generation, chunk, deadline)
+                chunk = []
+
+        if chunk:
+            yield (generation, chunk, deadline)
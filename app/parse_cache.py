@@ -0,0 +1,387 @@
+# Zechy Wong
+# 29 May 2017
+# Code-switching parser
+# ---------------------
+# Persistent parse results
+# - Complete sets of parses are kept in an SQLite file, keyed by the
+#   tokenised sentence and the parsing engine, so that sentences we have
+#   seen before (in a corpus, or at the REPL) are a single lookup
+# - Every entry is stamped with a fingerprint of everything the parses
+#   depend on: The lexica (source code and database contents), the phase
+#   heads, whether duplicate parses are dropped and the parser's own source
+#   code.  Entries with any other fingerprint are thrown out as soon as the
+#   fingerprint changes.
+# - The least recently used entries are evicted once the file holds more
+#   than `max_size` bytes of parses
+# - Switched off by default: The parser checks `active` against None (see
+#   config.parse_cache_file, and the REPL's 'cache' command)
+
+from __future__ import print_function, division
+
+import hashlib
+import importlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import config
+import app.lexical_array
+
+# Bump this whenever the database layout changes
+cache_version = 2
+
+# The modules whose source code goes into the parser's part of the
+# fingerprint
+parser_modules = ["app.parser", "app.chart", "app.lexical_array",
+                  "app.prefilter", "app.syntactic_object", "app.subcat"]
+
+# The ParseCache in use, or None if parse caching is switched off
+active = None
+
+
+def sentence_key(user_input):
+    """
+    The cache key for some input: Its tokens, so that inputs that only
+    differ in case, spacing or punctuation share an entry
+    :param user_input:
+    :return:
+    """
+    key = " ".join(app.lexical_array.tokenise(user_input))
+    if isinstance(key, bytes):
+        # SQLite wants unicode rather than (non-ASCII) byte strings
+        key = key.decode("utf-8")
+    return key
+
+
+def complete(found, max_parses, deadline):
+    """
+    Did a parse that came up with `found` parses run to completion?  (If it
+    was cut short, there may have been more, and the results shouldn't be
+    cached)
+    :param found:
+    :param max_parses:
+    :param deadline:
+    :return:
+    """
+    if max_parses is not None and found >= max_parses:
+        return False
+    if deadline is not None and time.time() > deadline:
+        return False
+    return True
+
+
+class ParseCache(object):
+    """
+    An SQLite file of complete parse results
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024):
+        """
+        :param path:
+        :param max_size: Bytes of (pickled) parses to keep, at most
+        """
+        self.path = path
+        self.max_size = max_size
+
+        # Connections can't be shared with forked worker processes, so each
+        # process opens its own; threads share it behind a lock
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.RLock()
+
+        # The fingerprint for the current config, and the (lexica, phase
+        # heads) it was worked out for
+        self.current_fingerprint = None
+        self.fingerprint_config = None
+
+        # Running total of the bytes stored, so that we don't have to add
+        # them up after every write
+        self.total_size = None
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def query(self, statement, parameters=()):
+        with self.lock:
+            if self.connection_pid != os.getpid():
+                self.connection = self.connect()
+                self.connection_pid = os.getpid()
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def connect(self):
+        """
+        Opens the database, setting it up if it is new
+        :return:
+        """
+        connection = sqlite3.connect(self.path, timeout=30,
+                                     check_same_thread=False)
+        # Write-ahead logging lets other processes read while we write; the
+        # cache is only an optimisation, so it isn't worth syncing every
+        # write to disk
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS meta ("
+                               "key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS parses ("
+                               "fingerprint TEXT NOT NULL, "
+                               "engine TEXT NOT NULL, "
+                               "sentence TEXT NOT NULL, "
+                               "parses BLOB NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "last_used REAL NOT NULL, "
+                               "PRIMARY KEY (fingerprint, engine, sentence))")
+            connection.execute("CREATE INDEX IF NOT EXISTS parses_last_used "
+                               "ON parses (last_used)")
+
+            rows = connection.execute("SELECT value FROM meta "
+                                      "WHERE key = 'version'").fetchall()
+            if len(rows) == 0 or rows[0][0] != str(cache_version):
+                # New, or from some incompatible version: Start afresh
+                connection.execute("DELETE FROM parses")
+                connection.execute("INSERT OR REPLACE INTO meta "
+                                   "VALUES ('version', ?)",
+                                   (str(cache_version),))
+        return connection
+
+    def fingerprint(self):
+        """
+        A hash of everything the parses depend on, worked out again whenever
+        config.lexica, config.phase_heads or config.deduplicate_parses is
+        replaced.
+        When it changes, every entry with some other fingerprint is thrown
+        out.
+        (Lexica changed in place after they were set up aren't noticed --
+        Replace the lexicon object, or clear() the cache)
+        None if some of the source code involved can't be found (e.g., for a
+        lexicon defined interactively): Nothing is cached then
+        :return:
+        """
+        current_config = (tuple(config.lexica), config.phase_heads,
+                          config.deduplicate_parses)
+        if (self.fingerprint_config is not None and
+                len(self.fingerprint_config[0]) == len(current_config[0]) and
+                all(old is new for old, new in
+                    zip(self.fingerprint_config[0], current_config[0])) and
+                self.fingerprint_config[1] is current_config[1] and
+                self.fingerprint_config[2] == current_config[2]):
+            return self.current_fingerprint
+
+        self.current_fingerprint = self.compute_fingerprint()
+        self.fingerprint_config = current_config
+        if self.current_fingerprint is None:
+            return None
+
+        with self.lock:
+            self.query("DELETE FROM parses WHERE fingerprint != ?",
+                       (self.current_fingerprint,))
+            self.connection.commit()
+            self.total_size = None
+        return self.current_fingerprint
+
+    @staticmethod
+    def compute_fingerprint():
+        """
+        Hash the current config, lexica and parser source for fingerprint()
+        :return:
+        """
+        digest = hashlib.sha1(str(cache_version).encode("utf-8"))
+        for lexicon in config.lexica:
+            lexicon_fingerprint = lexicon.fingerprint()
+            if lexicon_fingerprint is None:
+                return None
+            digest.update(lexicon.id.encode("utf-8"))
+            digest.update(lexicon_fingerprint.encode("utf-8"))
+        digest.update(" ".join(sorted(config.phase_heads)).encode("utf-8"))
+        digest.update(str(config.deduplicate_parses).encode("utf-8"))
+        for name in parser_modules:
+            module = importlib.import_module(name)
+            source_path = inspect.getsourcefile(module)
+            if source_path is None:
+                return None
+            with open(source_path, "rb") as source_file:
+                digest.update(source_file.read())
+        return digest.hexdigest()
+
+    def get(self, user_input, engine):
+        """
+        The cached results for the given input and engine, as a list of
+        (frozen) SOs plus the number of duplicate parses that were dropped
+        from it, or None if there aren't any
+        :param user_input:
+        :param engine:
+        :return:
+        """
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            self.misses += 1
+            return None
+
+        key = (fingerprint, engine, sentence_key(user_input))
+        with self.lock:
+            rows = self.query("SELECT parses FROM parses WHERE "
+                              "fingerprint = ? AND engine = ? AND "
+                              "sentence = ?", key)
+            if len(rows) == 0:
+                self.misses += 1
+                return None
+
+            self.query("UPDATE parses SET last_used = ? WHERE "
+                       "fingerprint = ? AND engine = ? AND sentence = ?",
+                       (time.time(),) + key)
+            self.connection.commit()
+
+        self.hits += 1
+        return pickle.loads(bytes(rows[0][0]))
+
+    def put(self, user_input, engine, parses, duplicates=0):
+        """
+        Cache the complete list of parses for the given input and engine,
+        evicting old entries if the cache gets too big
+        :param user_input:
+        :param engine:
+        :param parses:
+        :param duplicates: Duplicate parses dropped from the list (see
+            app.parser.Deduplicator), to report again on a hit
+        :return:
+        """
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            return
+
+        data = pickle.dumps((list(parses), duplicates),
+                            pickle.HIGHEST_PROTOCOL)
+        key = (fingerprint, engine, sentence_key(user_input))
+        with self.lock:
+            old_size = self.query("SELECT size FROM parses WHERE "
+                                  "fingerprint = ? AND engine = ? AND "
+                                  "sentence = ?", key)
+            self.query("INSERT OR REPLACE INTO parses VALUES "
+                       "(?, ?, ?, ?, ?, ?)",
+                       key + (sqlite3.Binary(data), len(data), time.time()))
+            self.connection.commit()
+            self.writes += 1
+
+            if self.total_size is None:
+                self.total_size = self.size()
+            else:
+                self.total_size += len(data)
+                if len(old_size) > 0:
+                    self.total_size -= old_size[0][0]
+
+            if self.total_size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Throw out the least recently used entries until the cache is back
+        under 90% of its maximum size (so that we aren't evicting on every
+        write)
+        :return:
+        """
+        with self.lock:
+            # Other processes may have written to it as well
+            self.total_size = self.size()
+            target = self.max_size * 0.9
+
+            doomed = []
+            for rowid, size in self.query("SELECT rowid, size FROM parses "
+                                          "ORDER BY last_used"):
+                if self.total_size <= target:
+                    break
+                doomed.append((rowid,))
+                self.total_size -= size
+
+            self.connection.executemany("DELETE FROM parses WHERE rowid = ?",
+                                        doomed)
+            self.connection.commit()
+            self.evictions += len(doomed)
+
+    def size(self):
+        """
+        Bytes of parses stored
+        :return:
+        """
+        return self.query("SELECT COALESCE(SUM(size), 0) FROM parses")[0][0]
+
+    def __len__(self):
+        return self.query("SELECT COUNT(*) FROM parses")[0][0]
+
+    def clear(self):
+        with self.lock:
+            self.query("DELETE FROM parses")
+            self.connection.commit()
+            self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and \
+                    self.connection_pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+            self.connection_pid = None
+
+    def report(self):
+        """
+        Lines of text describing the cache, for the REPL
+        :return:
+        """
+        lookups = self.hits + self.misses
+        hit_rate = 0
+        if lookups > 0:
+            hit_rate = self.hits / lookups
+        return ["Parse cache: {}".format(self.path),
+                "  {} entries, {:.1f} KiB of {:.1f} KiB"
+                "".format(len(self), self.size() / 1024,
+                          self.max_size / 1024),
+                "  {} hits, {} misses ({:.0%} hit rate)"
+                "".format(self.hits, self.misses, hit_rate),
+                "  {} writes, {} evictions".format(self.writes,
+                                                   self.evictions)]
+
+
+def start(path, max_size=None):
+    """
+    Switch parse caching on (replacing any existing cache)
+    :param path: SQLite file to keep the parses in (created if needed)
+    :param max_size: Bytes of parses to keep, at most (default:
+        config.parse_cache_size)
+    :return: The new cache
+    """
+    global active
+
+    if max_size is None:
+        max_size = config.parse_cache_size
+
+    stop()
+    active = ParseCache(path, max_size)
+    return active
+
+
+def stop():
+    """
+    Switch parse caching off
+    :return:
+    """
+    global active
+
+    if active is not None:
+        active.close()
+    active = None
+
+
+if config.parse_cache_file is not None:
+    start(config.parse_cache_file)
@@ -7,184 +7,535 @@
 # - Tokenisation and lexical array construction are farmed out to the
 #   LexicalArray class
 # - Phase edge detection and lexicon switch handled in the merge() method
+# - Merged SOs are kept in a process-wide cache (bounded by the memory its
+#   entries keep alive), so that constituents that turn up again in later
+#   sentences (in a batch run or a server) are built once
+# - Complete results can be kept on disk between runs (see app.parse_cache)
+# - parse_forest() hands ambiguous results back packed (see app.forest)
+# - Parses that come out structurally identical (e.g., from different
+#   lexical arrays) are only generated once (see Deduplicator)
+# - check_parse() remembers which of the states it starts afresh from (i.e.,
+#   with nothing shifted to the left) lead nowhere, so that the same
+#   sub-problem, met again under another lexical array or on a retry, is
+#   only worked through once
 
 from __future__ import print_function
 
-import pprint
+import sys
+import time
+from collections import deque
 
 import config
+import app.chart
+import app.forest
 import app.lexical_array
-from app.syntactic_object import SO
+import app.parse_cache
+import app.prefilter
+import app.stats
+import app.trace
+from app.cache import LRUCache, SizedLRU
+from app.syntactic_object import FrozenSO, intern_features
+# Subcategorisation matching lives in its own module so that the lexica can
+# use it while they are being set up
+from app.subcat import subcat_match
+
+# Verdicts (parse or no parse) for the fresh states check_parse() has met,
+# keyed by state_key()
+memo_size = 65536
+memo = LRUCache(memo_size)
+# States with fewer SOs than this still to come are quicker to work through
+# than to look up
+memo_min_length = 5
+
+
+def merge_entry_size(key, parent):
+    """
+    Bytes a merge_cache entry keeps alive: The key and its subcat list, and
+    every SO under the merged parent (or, for failed merges, under the head
+    and complement in the key) -- See FrozenSO.tree_size().
+    Each SO is counted twice over, since a canonical form (see
+    SO.canonical()) no bigger than the SO itself may hang off it.
+    Subtrees shared between entries are counted in each of them, so the
+    total errs on the high side, and merge_cache_size is a ceiling on the
+    memory the cache holds on to.
+    :param key:
+    :param parent:
+    :return:
+    """
+    head, complement, _, new_subcat, _ = key
+    if parent is False:
+        trees = head.tree_size() + complement.tree_size()
+    else:
+        # (The head and complement are the parent's children)
+        trees = parent.tree_size()
+    return sys.getsizeof(key) + sys.getsizeof(new_subcat) + 64 + 2 * trees
+
+
+# Results of merge(), for frozen heads and complements, across sentences
+# (See merge_entry_size() for how entries are sized)
+merge_cache_size = 32 * 1024 * 1024
+merge_cache = SizedLRU(merge_cache_size, merge_entry_size)
 
 
-def parse_string(user_input):
+def parse_string(user_input, engine=None, max_parses=None, deadline=None,
+                 executor=None, stats=None, deduplicator=None):
     """
     Attempts to provide parses for some user-given string.
     Does not assume complete sentences.
+    Generates parses as they are found, stopping early once either limit is
+    hit
     :param user_input: 
+    :param engine: (scan|chart) Which parsing engine to use; defaults to
+        config.engine
+    :param max_parses: Stop after this many parses have been found
+    :param deadline: Stop looking for parses once time.time() passes this
+    :param executor: An app.parallel.ParseExecutor, to check the lexical
+        arrays in parallel (scan engine only)
+    :param stats: An app.stats.ParseStats to fill in with timings and
+        counts for this parse (work done in other processes is not counted)
+    :param deduplicator: The Deduplicator to drop duplicate parses with,
+        e.g. to see how many it dropped afterwards (if
+        config.deduplicate_parses is set; default: a new one)
     :return: 
     """
+    # (The stats are only active while the parser is actually working, not
+    # while the caller has the parses)
+    parses = find_parses(user_input, engine, max_parses, deadline, executor,
+                         deduplicator)
+    for parse in app.stats.collected(stats, parses):
+        yield parse
+
+
+def find_parses(user_input, engine=None, max_parses=None, deadline=None,
+                executor=None, deduplicator=None, lattices=None):
+    """
+    The work of parse_string() (and of batch parsing), without the stats
+    collection: Look in the parse cache, or parse the input and put the
+    results in the cache if they are complete
+    :param user_input:
+    :param engine:
+    :param max_parses:
+    :param deadline:
+    :param executor:
+    :param deduplicator:
+    :param lattices: If given, the lattice for the input (or False, for OOV
+        input) is appended to this list when the input is enumerated (i.e.,
+        unless the parses come from the cache)
+    :return:
+    """
     # The idea: By looking up the tokens in the lexica, create a list of all
     # the possible combinations of SOs that we will consider.
     # Then go through the list, making sure that every subcategorisation is
     # satisfied.
-    # Present the parses that survived.
-
-    # Start by getting the LexicalArray class to help us tokenise the input
-    # and generate a list of all possible lexical arrays: Lists of
-    # possible SO combinations.
-    parse_combos = app.lexical_array.enumerate_input(user_input)
-    if not parse_combos:
+    # Present the parses that survive, as they survive.
+    if max_parses is not None and max_parses <= 0:
+        return
+
+    if engine is None:
+        engine = config.engine
+    if config.deduplicate_parses and deduplicator is None:
+        deduplicator = Deduplicator()
+
+    # Have we parsed this before?
+    cache = app.parse_cache.active
+    if cache is not None:
+        with app.stats.stage("parse_cache"):
+            cached = cache.get(user_input, engine)
+        if cached is not None:
+            parses, duplicates = cached
+            if deduplicator is not None:
+                # (As many as were dropped when the input was parsed)
+                deduplicator.count_dropped(duplicates)
+            for parse in parses[:max_parses]:
+                yield parse
+            return
+
+    # Start by getting the LexicalArray module to help us tokenise the
+    # input and arrange the possible SOs into a lattice, which covers
+    # every possible lexical array: Lists of possible SO combinations.
+    with app.stats.stage("enumerate_input"):
+        lattice = app.lexical_array.enumerate_input(user_input)
+    if lattices is not None:
+        lattices.append(lattice)
+    if not lattice:
         # Did not manage to enumerate the input
-        return []
+        return
+
+    found = []
+    for parse in parse_lattice(lattice, engine, max_parses, deadline,
+                               executor, deduplicator):
+        if cache is not None:
+            found.append(parse)
+        yield parse
+
+    # Only complete results go in the cache
+    if cache is not None and app.parse_cache.complete(len(found),
+                                                      max_parses,
+                                                      deadline):
+        duplicates = 0
+        if deduplicator is not None:
+            duplicates = deduplicator.dropped
+        with app.stats.stage("parse_cache"):
+            cache.put(user_input, engine, found, duplicates)
+
+
+def parse_forest(user_input, deadline=None, stats=None):
+    """
+    Parses some user-given string with the chart engine, returning every
+    parse at once as an app.forest.PackedForest: Constituents that several
+    parses share are only kept once, and the individual trees are only built
+    when they are asked for.
+    (Forests are not kept in the parse cache)
+    :param user_input:
+    :param deadline: Stop building constituents once time.time() passes
+        this; the forest then holds the parses completed so far
+    :param stats: An app.stats.ParseStats to fill in, as for parse_string()
+    :return:
+    """
+    with app.stats.collecting(stats):
+        with app.stats.stage("enumerate_input"):
+            lattice = app.lexical_array.enumerate_input(user_input)
+        if not lattice:
+            # Nothing to parse: An empty forest
+            return app.forest.PackedForest(app.chart.Chart(), 0, 0)
+
+        return app.chart.chart_forest(lattice, deadline)
 
-    # Attempt to parse recursively, SO-by-SO, keeping track of what's on
-    # the left and right
-    checked_parses = [check_parse(left=[], right=parse_combo)
-                      for parse_combo in parse_combos]
 
-    # Return any parses that survived the check
-    return filter(None, checked_parses)
+def parse_lattice(lattice, engine=None, max_parses=None, deadline=None,
+                  executor=None, deduplicator=None):
+    """
+    Generates the parses for an already-enumerated LexicalLattice, with the
+    same options as parse_string()
+    :param lattice:
+    :param engine:
+    :param max_parses:
+    :param deadline:
+    :param executor:
+    :param deduplicator:
+    :return:
+    """
+    if max_parses is not None and max_parses <= 0:
+        return
+
+    if engine is None:
+        engine = config.engine
+
+    if engine == "chart":
+        # The chart reads the lattice directly; every complete parse in the
+        # chart survives
+        parses = app.chart.chart_parse(lattice, deadline)
+    elif engine == "scan" and executor is not None:
+        parses = executor.scan_parse(lattice, deadline)
+    elif engine == "scan":
+        parses = scan_parse(lattice, deadline)
+    else:
+        raise ValueError("Unknown parsing engine: {}".format(engine))
+
+    if config.deduplicate_parses:
+        # (Only distinct parses count towards max_parses)
+        if deduplicator is None:
+            deduplicator = Deduplicator()
+        parses = deduplicator.filter(parses)
 
+    for found, parse in enumerate(parses, 1):
+        yield parse
+        if max_parses is not None and found >= max_parses:
+            return
 
-def check_parse(left, right, parse=None, last_active=0):
+
+class Deduplicator:
     """
-    Parse the given array of SOs recursively
-    Make sure the subcategorisations are satisfied, or return False
-    Also try to detect when repeating the parse attempt will go nowhere
-    :param left: 
-    :param right: 
-    :param parse: 
-    :param last_active: 
-    :return: 
+    Drops parses that are structurally identical to one it has already let
+    through (see SO.canonical()), e.g. where different lexical arrays, or
+    different ways of satisfying the same subcats, end up with the same tree
     """
-    if config.debug:
-        print("SOs on the Left:")
-        pprint.pprint(left)
-        print()
-        print("SOs on the Right:")
-        pprint.pprint(right)
 
+    def __init__(self):
+        # Canonical forms of the parses let through so far (held for as long
+        # as the deduplicator is)
+        self.seen = set()
+
+        # Parses dropped so far
+        self.dropped = 0
+
+    def unique(self, parse):
+        """
+        Is the parse different from every one seen so far?  Duplicates are
+        counted (and traced) as dropped.
+        :param parse:
+        :return:
+        """
+        canonical = parse.canonical()
+        if canonical not in self.seen:
+            self.seen.add(canonical)
+            return True
+
+        self.count_dropped(1)
+        tracer = app.trace.active
+        if tracer is not None:
+            tracer.emit("duplicate-parse", parse)
+        return False
+
+    def count_dropped(self, count):
+        """
+        Count parses as dropped (e.g., the ones dropped when some cached
+        results were first parsed)
+        :param count:
+        :return:
+        """
+        self.dropped += count
+        stats = app.stats.active
+        if stats is not None:
+            stats.duplicates += count
+
+    def filter(self, parses):
+        """
+        Generates the unique parses from the given ones, as they come
+        :param parses:
+        :return:
+        """
+        for parse in parses:
+            if self.unique(parse):
+                yield parse
+
+
+def scan_parse(lattice, deadline=None):
+    """
+    Runs check_parse() over each lexical array in the lattice in turn,
+    generating any parses that survive the check
+    :param lattice:
+    :param deadline: Stop looking for parses once time.time() passes this
+    :return:
+    """
+    stats = app.stats.active
+    for parse_combo in feasible_combinations(lattice):
+        if deadline is not None and time.time() > deadline:
+            return
+
+        # Attempt to parse SO-by-SO, keeping track of what's on the left and
+        # right
+        if stats is None:
+            parse = check_parse(left=[], right=parse_combo)
+        else:
+            start_time = time.time()
+            parse = check_parse(left=[], right=parse_combo)
+            stats.add_time("check_parse", time.time() - start_time)
         if parse:
-            print()
-            print("Currently built-up parse:")
-            print(parse.to_brackets())
+            yield parse
 
-        print(".,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__"
-              ",.-'~'-.,__,.")
 
-    # Base case:
-    if len(left) == 0 and len(right) == 0:
-        # We made it
-        return parse
+def feasible_combinations(lattice):
+    """
+    Generates the lexical arrays in the lattice, minus any that the
+    prefilter can tell will never parse (if config.prefilter is set)
+    :param lattice:
+    :return:
+    """
+    stats = app.stats.active
+    if not config.prefilter:
+        for parse_combo in lattice.combinations():
+            if stats is not None:
+                stats.combinations += 1
+            yield parse_combo
+        return
+
+    with app.stats.stage("prefilter"):
+        prefilter = app.prefilter.Prefilter(lattice)
+
+    for parse_combo in lattice.combinations():
+        if stats is None:
+            feasible = prefilter.feasible(parse_combo)
+        else:
+            stats.combinations += 1
+            start_time = time.time()
+            feasible = prefilter.feasible(parse_combo)
+            stats.add_time("prefilter", time.time() - start_time)
+        if feasible:
+            yield parse_combo
+
 
-    # We go from left to right; if any subcategorisations are not fulfilled,
-    # we move another step and try again
+def state_key(right, parse):
+    """
+    The memo key for a fresh state (nothing on the left): The signatures of
+    the current parse and of everything still to come.
+    Every decision check_parse() makes only looks at the signatures of the
+    SOs involved (see SO.signature_id()), and the signature of a merged SO
+    only depends on those of its head and complement, so two states with the
+    same key end the same way.
+    :param right:
+    :param parse:
+    :return:
+    """
     if parse is None:
-        consider_so = right.pop(0)
+        parse_signature = None
     else:
-        consider_so = parse
-
-    if len(consider_so.subcat) == 0:
-        # This SO does not subcategorise.  Is anything on the sides looking
-        # for something?
-        if len(left) > 0 and len(left[-1].subcat) > 0:
-            # Look at the closest thing on the left
-            criteria = left[-1].subcat[0]
-            if criteria[0] == "right" and subcat_match(criteria[1],
-                                                       consider_so):
-                # A match. Pop last element from left array
-                head = left.pop()
-                parse = merge(head=head,
-                              complement=consider_so,
-                              head_direction="left",
-                              new_subcat=head.subcat[1:])
-                if not parse:
-                    # Poopsy, merge failed
-                    return False
+        parse_signature = parse.signature_id()
+    # The signatures include the last phase lexica, which depend on the
+    # phase heads
+    return (config.phase_heads, parse_signature,
+            tuple([so.signature_id() for so in right]))
 
-                return check_parse(left, right, parse)
 
-        if len(right) > 0 and len(right[0].subcat) > 0:
-            # On the right
-            criteria = right[0].subcat[0]
-            if criteria[0] == "left" and subcat_match(criteria[1],
-                                                      consider_so):
-                # A match. Pop first element from right array
-                head = right.pop(0)
+def check_parse(left, right, parse=None):
+    """
+    Parse the given array of SOs, SO-by-SO from left to right, as a
+    shift-reduce loop
+    Make sure the subcategorisations are satisfied, or return False
+    If we get to the end with unsatisfied subcats, the array is given another
+    run-through, but only while the run-throughs are still making progress
+    (i.e., merging things together)
+    :param left: SOs already shifted past
+    :param right: SOs still to come
+    :param parse: The currently built-up parse, if any
+    :return:
+    """
+    left = list(left)
+    right = deque(right)
+
+    # The size of the array (left + current + right) the last time we had a
+    # fresh start, i.e., nothing on the left.  If we get to the end without
+    # the array getting any smaller since then, another run-through from
+    # that point would only do the same thing again.
+    fresh_size = len(left) + len(right) + (parse is not None)
+
+    # None unless tracing/stats collection is switched on
+    tracer = app.trace.active
+    stats = app.stats.active
+    if stats is not None:
+        stats.check_parse_calls += 1
+
+    # Keys for the fresh states met so far, which all end the same way this
+    # call does.  (At a fresh state, fresh_size is just the size of the
+    # array, so the key doesn't need it)
+    fresh_keys = []
+
+    while True:
+        # Base case:
+        if len(left) == 0 and len(right) == 0:
+            # We made it
+            for key in fresh_keys:
+                memo.put(key, True)
+            return parse
+
+        if len(left) == 0 and len(right) >= memo_min_length:
+            # Fresh state: Have we been here before?
+            key = state_key(right, parse)
+            verdict = memo.get(key)
+            if stats is not None:
+                if verdict is None:
+                    stats.memo_misses += 1
+                else:
+                    stats.memo_hits += 1
+            if verdict is False:
+                if tracer is not None:
+                    tracer.emit("memo-fail", len(right) + (parse is not None))
+                for key in fresh_keys:
+                    memo.put(key, False)
+                return False
+            fresh_keys.append(key)
+
+        # We go from left to right; if any subcategorisations are not
+        # fulfilled, we move another step and try again
+        if parse is None:
+            consider_so = right.popleft()
+        else:
+            consider_so = parse
+
+        if len(consider_so.subcat) == 0:
+            # This SO does not subcategorise.  Is anything on the sides
+            # looking for something?
+            head = None
+            if len(left) > 0 and len(left[-1].subcat) > 0:
+                # Look at the closest thing on the left
+                criteria = left[-1].subcat[0]
+                if criteria[0] == "right":
+                    if tracer is not None:
+                        tracer.emit("merge-attempt", left[-1], consider_so)
+                    if stats is not None:
+                        stats.subcat_matches += 1
+                    if subcat_match(criteria[1], consider_so):
+                        # A match. Pop last element from left array
+                        head = left.pop()
+                        head_direction = "left"
+                    elif tracer is not None:
+                        tracer.emit("merge-fail", left[-1], consider_so,
+                                    "subcat")
+
+            if (head is None and len(right) > 0 and
+                    len(right[0].subcat) > 0):
+                # On the right
+                criteria = right[0].subcat[0]
+                if criteria[0] == "left":
+                    if tracer is not None:
+                        tracer.emit("merge-attempt", right[0], consider_so)
+                    if stats is not None:
+                        stats.subcat_matches += 1
+                    if subcat_match(criteria[1], consider_so):
+                        # A match. Pop first element from right array
+                        head = right.popleft()
+                        head_direction = "right"
+                    elif tracer is not None:
+                        tracer.emit("merge-fail", right[0], consider_so,
+                                    "subcat")
+
+            if head is not None:
                 parse = merge(head=head,
                               complement=consider_so,
-                              head_direction="right",
+                              head_direction=head_direction,
                               new_subcat=head.subcat[1:])
                 if not parse:
                     # Poopsy, merge failed
+                    if tracer is not None:
+                        tracer.emit("merge-fail", head, consider_so, "merge")
+                    for key in fresh_keys:
+                        memo.put(key, False)
                     return False
 
-                return check_parse(left, right, parse)
+                if len(left) == 0:
+                    # As good as starting over with the merged array
+                    fresh_size = len(right) + 1
+                continue
 
-        # Still here? We haven't found anything close (because we want to
-        # respect the ordering of subcats) -- Move on for now by falling
-        # through to the high-level checks
-        pass
+            # Still here? We haven't found anything close (because we want
+            # to respect the ordering of subcats) -- Move on for now by
+            # falling through to the high-level checks
 
-    # ----
+        # ----
+
+        # The current SO subcategorises, or we need to build up more of the
+        # parse first. Try moving a step to the right.
+        parse = None
+        if len(right) > 0:
+            if tracer is not None:
+                tracer.emit("shift", consider_so)
+            left.append(consider_so)
+            continue
 
-    # The current SO subcategorises, or we need to build up more of the
-    # parse
-    #  first. Try moving a step to the right.
-    if len(right) > 0:
-        left.append(consider_so)
-        return check_parse(left, right, None, last_active + 1)
-    else:
         # Got to the end, no good.
         # Last chance: Give it another run-through if there are items in
-        # left
-        # that don't subcat
+        # left that don't subcat, and this run-through got us somewhere
         found_non_subcat = False
         for check_subcat in left:
             if len(check_subcat.subcat) == 0:
                 found_non_subcat = True
+                break
 
-        # Make sure that the last real parse we did was not too many
-        # iterations ago
-        if found_non_subcat and last_active < len(left):
+        if found_non_subcat and len(left) + 1 < fresh_size:
             # One more time
-            return check_parse([], left + [consider_so], None)
+            if tracer is not None:
+                tracer.emit("retry", len(left) + 1)
+            right.extend(left)
+            right.append(consider_so)
+            del left[:]
+            fresh_size = len(right)
         else:
             # Ah well
+            for key in fresh_keys:
+                memo.put(key, False)
             return False
 
 
-def subcat_match(criteria, candidate):
-    """
-    Check if so_2 meets the subcategorisation criteria in so_1 (i.e., 
-    the two SOs can be unified, in some sense)
-    Returns true/false
-    :param criteria: 
-    :param candidate: 
-    :return: 
-    """
-
-    # Simple matching for categories and labels:
-    # True if either one is None, or both SOs have the same value
-    def simple_match(a, b):
-        return a is None or b is None or a == b
-
-    if not simple_match(criteria.category, candidate.category):
-        return False
-
-    if not simple_match(criteria.label, candidate.label):
-        return False
-
-    # Simple Feature matching:
-    # True if so_2's features are a superset of so_1's features
-    if not set(criteria.features) <= set(candidate.features):
-        return False
-
-    # Still here?
-    return True
-
-
 def merge(head, complement, head_direction, new_subcat):
     """
     Merges two SOs, a head an a complement together, keeping features on 
@@ -192,27 +543,54 @@ def merge(head, complement, head_direction, new_subcat):
     
     Only allows lexicon shift at phase boundaries
     
-    Returns a new SO that has the original head/complement as children
+    Returns a (frozen) SO that has the original head/complement as children
     Or False on failure
+    The result for frozen heads and complements is looked up in (or saved
+    to) merge_cache
     :param head: 
     :param complement: 
     :param head_direction: (left|right) Which side is the head on? 
     :param new_subcat: List of subcats for the new SO 
     :return: 
     """
-    parent = SO()
-
-    # Category and label
-    # (Label will be the category as well, for complex SOs)
-    parent.category = head.category
-    parent.label = head.category
+    stats = app.stats.active
+    if stats is not None:
+        stats.merge_attempts += 1
+
+    parent = None
+    key = None
+    if head.frozen and complement.frozen:
+        # (Whether a lexicon switch is allowed depends on the phase heads)
+        key = (head, complement, head_direction, tuple(new_subcat),
+               config.phase_heads)
+        parent = merge_cache.get(key)
+        if parent is not None and stats is not None:
+            stats.merge_cache_hits += 1
+
+    if parent is None:
+        parent = build_merge(head, complement, head_direction, new_subcat)
+        if key is not None:
+            merge_cache.put(key, parent)
+
+    if parent is False:
+        tracer = app.trace.active
+        if tracer is not None:
+            tracer.emit("phase-switch-reject", head, complement)
+        if stats is not None:
+            stats.merge_failures += 1
 
-    # Copy Features
-    parent.features = head.features[:]
+    return parent
 
-    # Save new subcat list
-    parent.subcat = new_subcat
 
+def build_merge(head, complement, head_direction, new_subcat):
+    """
+    The actual work of merge(), without the caching or the bookkeeping
+    :param head:
+    :param complement:
+    :param head_direction:
+    :param new_subcat:
+    :return:
+    """
     # Check if lexicon switch has occurred
     head_lexicon = head.last_phase_lexicon()
     complement_lexicon = complement.last_phase_lexicon()
@@ -228,11 +606,22 @@ def merge(head, complement, head_direction, new_subcat):
         if head.category not in config.phase_heads:
             return False
 
-    # Insert children SOs
+    # Children SOs
     assert head_direction == "left" or head_direction == "right"
     if head_direction == "left":
-        parent.children = [head, complement]
-    elif head_direction == "right":
-        parent.children = [complement, head]
+        children = (head.freeze(), complement.freeze())
+    else:
+        children = (complement.freeze(), head.freeze())
 
-    return parent
+    # Category and label
+    # (Label will be the category as well, for complex SOs)
+    # Features are shared with the head, and the new subcat list is saved
+    # Parents are hash-consed, so merging the same pair twice gives back the
+    # same SO
+    return FrozenSO.make(category=head.category,
+                         label=head.category,
+                         lexicon=None,
+                         features=intern_features(head.features),
+                         subcat=tuple(new_subcat),
+                         generate=(),
+                         children=children)
@@ -0,0 +1,171 @@
+# Zechy Wong
+# 28 May 2017
+# Code-switching parser
+# ---------------------
+# Lexical array prefilter
+# - Cheap, static checks that throw out lexical arrays which check_parse()
+#   could never build a parse from, before it gets to them
+# - Each check is a necessary condition for a parse, so an array that would
+#   have parsed is never thrown out:
+#   1) Every merge uses up one subcat entry, so an array of n SOs needs at
+#      least n - 1 subcat criteria between them, enough of them for each
+#      category in the array
+#   2) Every SO except the root (whose head must subcategorise) ends up as
+#      the complement of some merge, so something on the correct side of it
+#      must have a criterion that it could match
+#   3) Without a phase head to switch at, all the SOs must come from the
+#      same lexicon (see app.parser.merge())
+
+from collections import defaultdict
+
+import config
+import app.stats
+import app.trace
+from app.subcat import compile_criteria
+
+
+def could_select(matcher, so):
+    """
+    Could a head with the given (compiled) criteria select the SO as its
+    complement?
+    The complement is the SO itself if it doesn't subcategorise, and one of
+    its projections (labelled with its category) if it does.
+    :param matcher:
+    :param so:
+    :return:
+    """
+    if (matcher.category is not None and so.category is not None and
+            matcher.category != so.category):
+        return False
+
+    if len(so.subcat) > 0:
+        label = so.category
+    else:
+        label = so.label
+    if matcher.label is not None and label is not None and \
+            matcher.label != label:
+        return False
+
+    return so.feature_mask & matcher.mask == matcher.mask
+
+
+class Prefilter:
+    """
+    Feasibility checks for the lexical arrays in a single lattice.
+    The tables the checks use are worked out once, over the (distinct) SOs
+    that appear anywhere in the lattice.
+    """
+
+    def __init__(self, lattice):
+        sos = []
+        seen = set()
+        for _, _, so in lattice.edges():
+            if so not in seen:
+                seen.add(so)
+                sos.append(so)
+
+        # SO -> the SOs that could select it from the left (i.e., with a
+        # "right" criterion) and from the right
+        self.left_selectors = dict((so, set()) for so in sos)
+        self.right_selectors = dict((so, set()) for so in sos)
+
+        # SO -> ((category, number of criteria), ...); criteria with no
+        # category are counted under None
+        self.criteria_counts = {}
+
+        for head in sos:
+            counts = defaultdict(int)
+            for direction, criteria in head.subcat:
+                matcher = compile_criteria(criteria)
+                counts[matcher.category] += 1
+                if direction == "right":
+                    selectors = self.left_selectors
+                else:
+                    selectors = self.right_selectors
+                for so in sos:
+                    if could_select(matcher, so):
+                        selectors[so].add(head)
+            self.criteria_counts[head] = tuple(counts.items())
+
+        # Lexicon switches can only happen at phase heads that actually head
+        # something
+        self.phase_heads = frozenset(so for so in sos
+                                     if so.category in config.phase_heads and
+                                     len(so.subcat) > 0)
+
+        # Lexical arrays thrown out so far
+        self.discarded = 0
+
+    def feasible(self, lexical_array):
+        """
+        Could check_parse() possibly find a parse for the lexical array?
+        Arrays that fail are counted (and traced) as discarded.
+        :param lexical_array:
+        :return:
+        """
+        reason = self.check(lexical_array)
+        if reason is None:
+            return True
+
+        self.discarded += 1
+        stats = app.stats.active
+        if stats is not None:
+            stats.discarded += 1
+        tracer = app.trace.active
+        if tracer is not None:
+            tracer.emit("prefilter-discard", reason, len(lexical_array))
+        return False
+
+    def check(self, lexical_array):
+        """
+        Runs the checks over the lexical array, returning the name of the
+        first one that fails, or None if they all pass
+        :param lexical_array:
+        :return:
+        """
+        # 1) Enough subcat criteria, overall and for each category.
+        # The root doesn't need selecting, so one SO gets let off.
+        needed = defaultdict(int)
+        available = defaultdict(int)
+        lexica = set()
+        phase_head = False
+        for so in lexical_array:
+            needed[so.category] += 1
+            for category, count in self.criteria_counts[so]:
+                available[category] += count
+            if so.lexicon is not None:
+                lexica.add(so.lexicon)
+            if so in self.phase_heads:
+                phase_head = True
+
+        if sum(available.values()) < len(lexical_array) - 1:
+            return "criteria"
+
+        # SOs without a category can match anything, as can criteria without
+        # one
+        shortfall = 0
+        for category, count in needed.items():
+            if category is not None:
+                shortfall += max(0, count - available.get(category, 0))
+        if shortfall > available.get(None, 0) + 1:
+            return "categories"
+
+        # 3) Lexicon switches
+        if len(lexica) > 1 and not phase_head:
+            return "lexicon-switch"
+
+        # 2) Selectors on the correct side: Everything but (at most) one SO
+        # that subcategorises
+        unselected_root = False
+        to_left = set()
+        for idx in range(len(lexical_array)):
+            so = lexical_array[idx]
+            if self.left_selectors[so].isdisjoint(to_left):
+                if self.right_selectors[so].isdisjoint(
+                        lexical_array[idx + 1:]):
+                    if len(so.subcat) == 0 or unselected_root:
+                        return "selector"
+                    unselected_root = True
+            to_left.add(so)
+
+        return None
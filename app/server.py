@@ -0,0 +1,393 @@
+# Zechy Wong
+# 30 May 2017
+# Code-switching parser
+# ---------------------
+# Parse server
+# - Keeps the lexica (and every cache) warm between requests: Tools post
+#   sentences to a local HTTP JSON API instead of starting the parser up
+#   again each time
+# - Requests are handled on their own threads; the parsing itself is done
+#   by a pool of forked worker processes (which inherit the loaded lexica),
+#   or in the request threads one at a time (the parser's stats collection
+#   and tracing are process-wide, so concurrent parses would mix them up)
+# - A request can carry a whole batch of sentences, which are spread across
+#   the workers, and a time budget, which covers the whole batch
+# - ParseClient talks to a server, e.g. one started in the same process
+#   with ParseServer(port=0).start() for testing
+#
+# Endpoints:
+#   POST /parse   {"sentence": "..."} or {"sentences": ["...", ...]}, plus
+#                 optional "engine", "max_parses", "timeout" (seconds) and
+#                 "stats" -- Returns {"records": [...]}, one app.batch record
+#                 per sentence
+#   GET  /health  Whether the server is up, and what it is serving
+#   GET  /stats   Request (sentence, parse, duplicate...) counts and timings,
+#                 and how the caches are doing
+
+from __future__ import print_function, division
+
+import json
+import multiprocessing
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+try:
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
+import config
+import app.batch
+import app.parse_cache
+import app.parser
+
+
+class RequestError(Exception):
+    """
+    Something wrong with a request (reported back as a 400)
+    """
+    pass
+
+
+class ParseHTTPServer(ThreadingMixIn, HTTPServer):
+    # Don't hold up shutdown for requests in progress
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, parse_server):
+        HTTPServer.__init__(self, server_address, ParseRequestHandler)
+        self.parse_server = parse_server
+
+
+class ParseRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.parse_server.health())
+        elif self.path == "/stats":
+            self.send_json(200, self.server.parse_server.stats())
+        else:
+            self.send_json(404, {"error": "Not found: {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path != "/parse":
+            self.send_json(404, {"error": "Not found: {}".format(self.path)})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError:
+                raise RequestError("Request body is not valid JSON")
+            self.send_json(200, self.server.parse_server.handle(request))
+        except RequestError as error:
+            self.server.parse_server.count("errors")
+            self.send_json(400, {"error": str(error)})
+        except Exception as error:
+            self.server.parse_server.count("errors")
+            self.send_json(500, {"error": "{}: {}".format(
+                error.__class__.__name__, error)})
+
+    def send_json(self, status, body):
+        data = json.dumps(body, sort_keys=True).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, message_format, *args):
+        # Requests are only logged if the server was asked to
+        if not self.server.parse_server.quiet:
+            BaseHTTPRequestHandler.log_message(self, message_format, *args)
+
+
+class ParseServer(object):
+    """
+    Serves parse requests over HTTP, on localhost
+    """
+
+    def __init__(self, host="127.0.0.1", port=8642, workers=1,
+                 chunk_size=8, timeout=None, quiet=True):
+        """
+        :param host: Interface to listen on (only localhost is sensible:
+            There is no authentication)
+        :param port: 0 to pick any free port (see `port` afterwards)
+        :param workers: Worker processes to parse with; 1 parses on the
+            request threads instead
+        :param chunk_size: Sentences handed to a worker at a time
+        :param timeout: Default time budget per request, in seconds
+        :param quiet: Don't log each request to stderr
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.quiet = quiet
+
+        # Workers are forked now, while the lexica are loaded and nothing
+        # else is running
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers)
+
+        self.http_server = ParseHTTPServer((host, port), self)
+        self.host, self.port = self.http_server.server_address[:2]
+        self.thread = None
+
+        self.started = time.time()
+        # For the counters, and for parsing without workers
+        self.lock = threading.Lock()
+        self.parse_lock = threading.Lock()
+        self.counts = {"requests": 0,
+                       "sentences": 0,
+                       "parses": 0,
+                       "duplicates": 0,
+                       "timed_out": 0,
+                       "errors": 0}
+        self.parse_time = 0
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    def serve_forever(self):
+        """
+        Handle requests until interrupted (or shut down from another thread)
+        :return:
+        """
+        try:
+            self.http_server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self):
+        """
+        Handle requests on a background thread, e.g. for testing
+        :return: self
+        """
+        self.thread = threading.Thread(target=self.http_server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def shutdown(self):
+        """
+        Stop a server that was start()ed
+        :return:
+        """
+        self.http_server.shutdown()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def close(self):
+        self.http_server.server_close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counts[counter] += amount
+
+    def handle(self, request):
+        """
+        Parse the sentences in a /parse request
+        :param request: The decoded JSON request body
+        :return: The JSON-friendly response
+        """
+        if not isinstance(request, dict):
+            raise RequestError("Expected a JSON object")
+
+        if "sentences" in request:
+            sentences = request["sentences"]
+        elif "sentence" in request:
+            sentences = [request["sentence"]]
+        else:
+            raise RequestError("Expected 'sentence' or 'sentences'")
+        if not isinstance(sentences, list) or \
+                not all(isinstance(sentence, type(u"")) or
+                        isinstance(sentence, str) for sentence in sentences):
+            raise RequestError("Sentences should be strings")
+        # (The parser works on UTF-8 byte strings under Python 2)
+        sentences = [sentence if isinstance(sentence, str)
+                     else sentence.encode("utf-8") for sentence in sentences]
+
+        engine = request.get("engine")
+        if engine not in (None, "scan", "chart"):
+            raise RequestError("Unknown parsing engine: {}".format(engine))
+        max_parses = request.get("max_parses")
+        if max_parses is not None and \
+                (isinstance(max_parses, bool) or
+                 not isinstance(max_parses, integer_types) or
+                 max_parses < 0):
+            raise RequestError("max_parses should be a non-negative integer")
+        timeout = request.get("timeout", self.timeout)
+        if timeout is not None and \
+                (isinstance(timeout, bool) or
+                 not isinstance(timeout, integer_types + (float,))):
+            raise RequestError("timeout should be a number")
+
+        start_time = time.time()
+        deadline = None
+        if timeout is not None:
+            # The time budget covers the whole request
+            deadline = start_time + timeout
+        options = {"engine": engine,
+                   "max_parses": max_parses,
+                   "deadline": deadline,
+                   "stats": bool(request.get("stats", False))}
+
+        tasks = [(sentence, options) for sentence in sentences]
+        if self.pool is None:
+            with self.parse_lock:
+                records = [app.batch.parse_record_task(task)
+                           for task in tasks]
+        else:
+            records = self.pool.map(app.batch.parse_record_task, tasks,
+                                    self.chunk_size)
+
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["sentences"] += len(records)
+            self.counts["parses"] += sum(len(record["parses"])
+                                         for record in records)
+            self.counts["duplicates"] += sum(record["duplicates"]
+                                             for record in records)
+            self.counts["timed_out"] += sum(1 for record in records
+                                            if record["timed_out"])
+            self.parse_time += time.time() - start_time
+
+        return {"records": records}
+
+    def health(self):
+        return {"status": "ok",
+                "uptime": time.time() - self.started,
+                "workers": self.workers,
+                "engine": config.engine,
+                "lexica": [lexicon.id for lexicon in config.lexica]}
+
+    def stats(self):
+        """
+        Request counts and timings, and the caches' hit rates.
+        (The caches are those of the server process; worker processes keep
+        their own)
+        :return:
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats["parse_time"] = self.parse_time
+
+        stats["uptime"] = time.time() - self.started
+        stats["caches"] = {
+            "merge": {"hits": app.parser.merge_cache.hits,
+                      "misses": app.parser.merge_cache.misses,
+                      "entries": len(app.parser.merge_cache),
+                      "bytes": app.parser.merge_cache.size},
+            "check_parse": {"hits": app.parser.memo.hits,
+                            "misses": app.parser.memo.misses,
+                            "entries": len(app.parser.memo)},
+            # (Compiled lexica look every token up in a table, so only the
+            # others have a lookup cache to speak of)
+            "lookup": dict((lexicon.id,
+                            {"hits": lexicon.lookup_cache.hits,
+                             "misses": lexicon.lookup_cache.misses})
+                           for lexicon in config.lexica
+                           if lexicon.compiled is None)}
+
+        cache = app.parse_cache.active
+        if cache is not None:
+            stats["caches"]["parse"] = {"hits": cache.hits,
+                                        "misses": cache.misses,
+                                        "writes": cache.writes,
+                                        "evictions": cache.evictions}
+        return stats
+
+
+class ParseClient(object):
+    """
+    Talks to a ParseServer
+    """
+
+    def __init__(self, url="http://127.0.0.1:8642", timeout=None):
+        """
+        :param url:
+        :param timeout: How long to wait for the server (socket timeout),
+            in seconds
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, body=None):
+        """
+        Make a request, returning the decoded JSON response.
+        Raises RequestError if the server turned the request down
+        :param path:
+        :param body: JSON-friendly request body, for a POST
+        :return:
+        """
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        try:
+            response = urlopen(Request(self.url + path, data, headers),
+                               timeout=self.timeout)
+        except HTTPError as error:
+            try:
+                message = json.loads(error.read().decode("utf-8"))["error"]
+            except (ValueError, KeyError):
+                message = str(error)
+            raise RequestError(message)
+
+        try:
+            return json.loads(response.read().decode("utf-8"))
+        finally:
+            response.close()
+
+    def parse(self, sentences, engine=None, max_parses=None, timeout=None,
+              stats=False):
+        """
+        Parse one sentence or a list of them
+        :param sentences:
+        :param engine:
+        :param max_parses:
+        :param timeout: Time budget for the whole request, in seconds
+        :param stats: Include timings and counts in the records
+        :return: One record (see app.batch.parse_record()) per sentence, or
+            a single record if given a single sentence
+        """
+        single = not isinstance(sentences, list)
+        if single:
+            sentences = [sentences]
+
+        body = {"sentences": sentences, "stats": stats}
+        for name, value in (("engine", engine), ("max_parses", max_parses),
+                            ("timeout", timeout)):
+            if value is not None:
+                body[name] = value
+
+        records = self.request("/parse", body)["records"]
+        if single:
+            return records[0]
+        return records
+
+    def health(self):
+        return self.request("/health")
+
+    def stats(self):
+        return self.request("/stats")
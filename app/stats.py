@@ -0,0 +1,246 @@
+# Zechy Wong
+# 24 May 2017
+# Code-switching parser
+# ---------------------
+# Parse statistics
+# - A ParseStats object collects per-stage timings and counters (lexical
+#   arrays tried and discarded, merges, subcat checks, SO copies) for a parse
+# - Hand one to app.parser.parse_string() to have it filled in; while the
+#   parse runs (but not while the caller has its parses) it is kept in
+#   `active`, where the parser can find it
+# - Stages timed inside other stages (e.g., tokenise within enumerate_input)
+#   are remembered as such, and reported under them
+# - No dependencies on the rest of the app, so anything can count into it
+
+from __future__ import print_function, division
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Peak memory: Python-level allocations via tracemalloc if we have it,
+# otherwise (Python 2) the change in the process's resident set size over
+# the parse, where the OS will tell us what it is
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The ParseStats for the parse in progress, or None if nobody is collecting
+active = None
+
+
+class ParseStats(object):
+    """
+    Timings and counters for a single parse (or several, if the same object
+    is handed to each of them)
+    """
+
+    # Counter names, with their descriptions for report()
+    counters = OrderedDict([
+        ("combinations", "Lexical arrays generated"),
+        ("discarded", "Lexical arrays discarded"),
+        ("check_parse_calls", "check_parse() calls"),
+        ("memo_hits", "check_parse() memo hits"),
+        ("memo_misses", "check_parse() memo misses"),
+        ("merge_attempts", "merge() attempts"),
+        ("merge_failures", "merge() failures"),
+        ("merge_cache_hits", "merge() cache hits"),
+        ("duplicates", "Duplicate parses dropped"),
+        ("subcat_matches", "Subcat criteria checked"),
+        ("copies", "SO copies")
+    ])
+
+    def __init__(self, memory=False):
+        """
+        :param memory: Also track peak memory while parsing (tracemalloc
+            slows the parse down considerably)
+        """
+        # Stage name -> seconds spent in that stage, in the order the stages
+        # were first seen
+        self.stages = OrderedDict()
+        # Stage name -> the stage it was first timed inside of, for nested
+        # stages; and the stages currently being timed, innermost last
+        self.parents = {}
+        self.open_stages = []
+
+        for counter in self.counters:
+            setattr(self, counter, 0)
+
+        self.memory = memory
+        # Memory in bytes, and where the figure came from: The peak of
+        # Python-level allocations ("tracemalloc") or the change in resident
+        # set size ("RSS change")
+        self.peak_memory = None
+        self.memory_source = None
+
+    def add_time(self, stage, seconds):
+        if stage not in self.stages and len(self.open_stages) > 0:
+            self.parents[stage] = self.open_stages[-1]
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def to_dict(self):
+        """
+        A JSON-friendly version of the stats
+        :return:
+        """
+        stats_dict = {"stages": dict(self.stages),
+                      "stage_parents": dict(self.parents)}
+        for counter in self.counters:
+            stats_dict[counter] = getattr(self, counter)
+        if self.peak_memory is not None:
+            stats_dict["peak_memory"] = self.peak_memory
+            stats_dict["memory_source"] = self.memory_source
+        return stats_dict
+
+    def report(self):
+        """
+        Lines of text describing the stats, for the REPL
+        :return:
+        """
+        lines = ["Time:"]
+
+        def add_stages(parent, depth):
+            # (Nested stages are part of their parent's time, so they are
+            # listed under it rather than alongside it)
+            for stage, seconds in self.stages.items():
+                if self.parents.get(stage) == parent:
+                    lines.append("  {:<22} {:9.3f} ms".format(
+                        "  " * depth + stage, seconds * 1000))
+                    add_stages(stage, depth + 1)
+
+        add_stages(None, 0)
+
+        lines.append("Counts:")
+        for counter, description in self.counters.items():
+            lines.append("  {:<28} {}".format(description,
+                                               getattr(self, counter)))
+
+        if self.peak_memory is not None and \
+                self.memory_source == "tracemalloc":
+            lines.append("Peak memory (tracemalloc): {:.1f} KiB"
+                         "".format(self.peak_memory / 1024))
+        elif self.peak_memory is not None:
+            lines.append("Memory ({}): {:+.1f} KiB"
+                         "".format(self.memory_source,
+                                   self.peak_memory / 1024))
+        return lines
+
+
+def resident_memory():
+    """
+    The process's current resident set size in bytes, or None if we can't
+    tell (only Linux has /proc/self/statm)
+    :return:
+    """
+    if resource is None:
+        return None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+@contextmanager
+def collecting(stats):
+    """
+    Make `stats` the active ParseStats for the duration, tracking peak memory
+    as well if it asks for it.
+    Does nothing if `stats` is None.
+    :param stats:
+    :return:
+    """
+    global active
+
+    if stats is None:
+        yield
+        return
+
+    previous = active
+    active = stats
+
+    started_tracing = False
+    if stats.memory and tracemalloc is not None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    elif stats.memory:
+        # (ru_maxrss would be the largest the process has ever been, not
+        # anything to do with this parse)
+        baseline = resident_memory()
+
+    try:
+        yield
+    finally:
+        active = previous
+
+        if stats.memory and tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            stats.peak_memory = max(peak, stats.peak_memory or 0)
+            stats.memory_source = "tracemalloc"
+            if started_tracing:
+                tracemalloc.stop()
+        elif stats.memory and baseline is not None:
+            # Added up over the stretches the stats were active for (see
+            # collected())
+            resident = resident_memory()
+            if resident is not None:
+                stats.peak_memory = ((stats.peak_memory or 0) + resident -
+                                     baseline)
+                stats.memory_source = "RSS change"
+
+
+def collected(stats, parses):
+    """
+    Generates the given parses with `stats` active (see collecting()) only
+    while they are being worked out: Not while the caller has them, so that
+    anything it parses in the meantime isn't counted, and generators
+    suspended in between don't get their stats mixed up
+    :param stats:
+    :param parses: Generator of parses
+    :return:
+    """
+    if stats is None:
+        for parse in parses:
+            yield parse
+        return
+
+    parses = iter(parses)
+    while True:
+        with collecting(stats):
+            try:
+                parse = next(parses)
+            except StopIteration:
+                return
+        yield parse
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block as the given stage of the active ParseStats, if
+    there is one
+    :param name:
+    :return:
+    """
+    stats = active
+    if stats is None:
+        yield
+        return
+
+    stats.open_stages.append(name)
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        stats.open_stages.pop()
+        stats.add_time(name, time.time() - start_time)
@@ -0,0 +1,111 @@
+# Zechy Wong
+# 18 May 2017
+# Code-switching parser
+# ---------------------
+# Subcategorisation matching
+# - Used by both the parser and the lexicon rule systems; kept free of any
+#   dependency on config so that the lexica can use it while config is still
+#   setting them up
+# - Features are interned into per-process bitmasks, and subcat criteria are
+#   compiled into small matcher objects, so the innermost check is a couple
+#   of comparisons and a bitwise AND
+
+import threading
+
+# Every feature seen so far, mapped to its own bit
+feature_bits = {}
+# Held while handing out new bits, which may happen on several threads at
+# once
+feature_bits_lock = threading.Lock()
+
+
+def feature_mask(features):
+    """
+    Returns the bitmask for the given features, handing out new bits to any
+    features we haven't seen before
+    (The bits are per-process: Masks should never be saved anywhere)
+    :param features:
+    :return:
+    """
+    mask = 0
+    for feature in features:
+        bit = feature_bits.get(feature)
+        if bit is None:
+            with feature_bits_lock:
+                bit = feature_bits.get(feature)
+                if bit is None:
+                    bit = 1 << len(feature_bits)
+                    feature_bits[feature] = bit
+        mask |= bit
+    return mask
+
+
+class SubcatMatcher(object):
+    """
+    A compiled version of some subcategorisation criteria
+    """
+    __slots__ = ("category", "label", "mask")
+
+    def __init__(self, criteria):
+        self.category = criteria.category
+        self.label = criteria.label
+        self.mask = feature_mask(criteria.features)
+
+    def matches(self, candidate):
+        """
+        Check if the candidate SO meets these criteria
+        :param candidate:
+        :return:
+        """
+        # Simple matching for categories and labels:
+        # True if either one is None, or both SOs have the same value
+        if (self.category is not None and candidate.category is not None and
+                self.category != candidate.category):
+            return False
+
+        if (self.label is not None and candidate.label is not None and
+                self.label != candidate.label):
+            return False
+
+        # Simple Feature matching:
+        # True if the candidate's features are a superset of ours
+        return candidate.feature_mask & self.mask == self.mask
+
+
+# Frozen criteria SOs, mapped to their compiled matchers.
+# Frozen SOs are hash-consed, so identical criteria share a matcher.
+compiled_matchers = {}
+
+
+def compile_criteria(criteria):
+    """
+    Returns the SubcatMatcher for the given criteria SO, reusing the
+    compiled version if the criteria are frozen
+    :param criteria:
+    :return:
+    """
+    if not criteria.frozen:
+        return SubcatMatcher(criteria)
+
+    matcher = compiled_matchers.get(criteria)
+    if matcher is None:
+        # (setdefault(), so that threads compiling the same criteria at once
+        # end up sharing one matcher)
+        matcher = compiled_matchers.setdefault(criteria,
+                                               SubcatMatcher(criteria))
+    return matcher
+
+
+def subcat_match(criteria, candidate):
+    """
+    Check if so_2 meets the subcategorisation criteria in so_1 (i.e.,
+    the two SOs can be unified, in some sense)
+    Returns true/false
+    :param criteria:
+    :param candidate:
+    :return:
+    """
+    matcher = compiled_matchers.get(criteria)
+    if matcher is None:
+        matcher = compile_criteria(criteria)
+    return matcher.matches(candidate)
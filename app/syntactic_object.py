@@ -4,11 +4,25 @@
 # ---------------------
 # Class for dealing with individual syntactic objects
 
+import sys
+import threading
+import weakref
+
 import config
 import lexicon
+import app.stats
+from app.subcat import feature_mask
+
+
+class SO(object):
+    # Fixed set of attributes, to keep the per-SO memory footprint down
+    __slots__ = ("category", "label", "lexicon", "features", "subcat",
+                 "children", "generate", "__weakref__")
 
+    # Frozen SOs are shared (e.g., by the lexicon lookup caches) and can't be
+    # changed -- See freeze() and copy()
+    frozen = False
 
-class SO:
     def __init__(self, category=None, label=None, lexicon=None, features=None,
                  subcat=None, generate=None, children=None):
         # Syntactic category for the SO
@@ -43,23 +57,25 @@ class SO:
 
     def __repr__(self):
         # For generating a readable representation for debugging
+        # (Frozen SOs keep their lists as tuples and their features as sets;
+        # display them as lists all the same)
         if len(self.features) > 0:
-            features = ", features={}".format(self.features)
+            features = ", features={}".format(sorted(self.features))
         else:
             features = ""
 
         if len(self.subcat) > 0:
-            subcat = ", subcat={}".format(self.subcat)
+            subcat = ", subcat={}".format(list(self.subcat))
         else:
             subcat = ""
 
         if len(self.generate) > 0:
-            generate = ", generate={}".format(self.generate)
+            generate = ", generate={}".format(list(self.generate))
         else:
             generate = ""
 
         if len(self.children) > 0:
-            children = ", children={}".format(self.children)
+            children = ", children={}".format(list(self.children))
         else:
             children = ""
 
@@ -67,6 +83,98 @@ class SO:
                 "".format(self.category, self.label, self.lexicon,
                           features, subcat, generate, children))
 
+    @property
+    def feature_mask(self):
+        """
+        The bitmask for this SO's features, for subcategorisation matching
+        (Worked out on the fly; frozen SOs keep theirs)
+        :return:
+        """
+        return feature_mask(self.features)
+
+    def to_dict(self):
+        """
+        Returns a plain (JSON-friendly) dictionary representation of this SO
+        and everything under it; the inverse of SO.from_dict()
+        Empty fields are left out, as in __repr__()
+        :return:
+        """
+        so_dict = {"category": self.category,
+                   "label": self.label,
+                   "lexicon": self.lexicon}
+        if len(self.features) > 0:
+            so_dict["features"] = sorted(self.features)
+        if len(self.subcat) > 0:
+            so_dict["subcat"] = [[criteria[0], criteria[1].to_dict()]
+                                 for criteria in self.subcat]
+        if len(self.generate) > 0:
+            so_dict["generate"] = [[generate_params[0],
+                                    generate_params[1].to_dict()]
+                                   for generate_params in self.generate]
+        if len(self.children) > 0:
+            so_dict["children"] = [child.to_dict() for child in self.children]
+        return so_dict
+
+    @staticmethod
+    def from_dict(so_dict):
+        """
+        Rebuilds an SO from its SO.to_dict() representation
+        (Returns a plain, writable SO; freeze() it if it is to be shared)
+        :param so_dict:
+        :return:
+        """
+        return SO(category=so_dict.get("category"),
+                  label=so_dict.get("label"),
+                  lexicon=so_dict.get("lexicon"),
+                  features=list(so_dict.get("features", [])),
+                  subcat=[(criteria[0], SO.from_dict(criteria[1]))
+                          for criteria in so_dict.get("subcat", [])],
+                  generate=[(generate_params[0],
+                             SO.from_dict(generate_params[1]))
+                            for generate_params in so_dict.get("generate",
+                                                               [])],
+                  children=[SO.from_dict(child)
+                            for child in so_dict.get("children", [])])
+
+    def copy(self):
+        """
+        Returns a private, writable copy of this SO, for code that needs to
+        change a (possibly frozen) SO: The lists are copied, but the SOs they
+        refer to are shared.
+        :return:
+        """
+        stats = app.stats.active
+        if stats is not None:
+            stats.copies += 1
+
+        return SO(category=self.category,
+                  label=self.label,
+                  lexicon=self.lexicon,
+                  features=list(self.features),
+                  subcat=list(self.subcat),
+                  generate=list(self.generate),
+                  children=list(self.children))
+
+    def freeze(self):
+        """
+        Returns the frozen (immutable, shared) version of this SO, and of
+        every SO it refers to.  Anything that wants to change it afterwards
+        should work on a copy().
+        Frozen SOs are hash-consed: Structurally identical SOs freeze to the
+        very same object.
+        :return:
+        """
+        return FrozenSO.make(
+            category=self.category,
+            label=self.label,
+            lexicon=self.lexicon,
+            features=intern_features(self.features),
+            subcat=tuple((criteria[0], criteria[1].freeze())
+                         for criteria in self.subcat),
+            generate=tuple((generate_params[0], generate_params[1].freeze())
+                           for generate_params in self.generate),
+            children=tuple(child.freeze() for child in self.children))
+
     def to_brackets(self):
         """
         Returns a prettified/simplified representation of this SO (in bracket 
@@ -110,3 +218,259 @@ class SO:
             return_set.remove(None)
 
         return return_set
+
+    def signature_id(self):
+        """
+        A small integer standing for everything about this SO that the rest
+        of a parse can see (as for app.chart.signature()): SOs with the same
+        signature ID match and merge the same way.
+        :return:
+        """
+        return self.freeze().signature_id()
+
+    def canonical(self):
+        """
+        The canonical form of this SO: The FrozenSO with the same structure
+        as it would be written out (the category, label, lexicon and features
+        of each node, and its children), but no subcat or generate lists.
+        Parses that only differ in the subcat and generate lists they were
+        built with have the same canonical form.
+        :return:
+        """
+        return self.freeze().canonical()
+
+
+class FrozenSO(SO):
+    """
+    The immutable variant of SO.
+    Features are held as (interned) frozensets, and subcats, generates and
+    children as tuples of other FrozenSOs.  Since FrozenSOs are hash-consed,
+    two of them are structurally identical if and only if they are the same
+    object, so equality and hashing are by identity, and O(1).
+    Create them with FrozenSO.make() or SO.freeze(), not directly.
+    """
+    # The last phase lexicon is worked out once, when the SO is built, along
+    # with the config.phase_heads it was worked out against.
+    # Likewise the bitmask for the SO's features, and (when first asked for)
+    # its signature ID, canonical form and tree size.
+    __slots__ = ("cached_phase_lexicon", "cached_phase_heads", "feature_mask",
+                 "cached_signature_id", "cached_canonical", "cached_size")
+
+    frozen = True
+
+    # Hash-cons table: Structural key -> the one FrozenSO with that structure.
+    # Weak, so that SOs nobody is using any more don't pile up in here.
+    table = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def make(category, label, lexicon, features, subcat, generate, children):
+        """
+        Returns the FrozenSO with the given structure, creating it if needed
+        Expects `features` to be an interned frozenset (see intern_features())
+        and the rest to be tuples of FrozenSOs
+        :return:
+        """
+        key = (category, label, lexicon, features, subcat, generate, children)
+        so = FrozenSO.table.get(key)
+        if so is None:
+            so = object.__new__(FrozenSO)
+            set_attribute = object.__setattr__
+            set_attribute(so, "category", category)
+            set_attribute(so, "label", label)
+            set_attribute(so, "lexicon", lexicon)
+            set_attribute(so, "features", features)
+            set_attribute(so, "subcat", subcat)
+            set_attribute(so, "generate", generate)
+            set_attribute(so, "children", children)
+            set_attribute(so, "feature_mask", feature_mask(features))
+            set_attribute(so, "cached_phase_heads", None)
+            set_attribute(so, "cached_signature_id", None)
+            set_attribute(so, "cached_canonical", None)
+            set_attribute(so, "cached_size", None)
+            so.last_phase_lexicon()
+
+            # Another thread may have made the same SO in the meantime: Only
+            # one of them can go in the table
+            with table_lock:
+                existing = FrozenSO.table.get(key)
+                if existing is None:
+                    FrozenSO.table[key] = so
+                else:
+                    so = existing
+
+        return so
+
+    def replace(self, **fields):
+        """
+        Returns the FrozenSO that is the same as this one apart from the
+        given fields, without going through a copy().
+        New features should be interned and new SOs frozen, as for make()
+        :param fields:
+        :return:
+        """
+        return FrozenSO.make(fields.get("category", self.category),
+                             fields.get("label", self.label),
+                             fields.get("lexicon", self.lexicon),
+                             fields.get("features", self.features),
+                             fields.get("subcat", self.subcat),
+                             fields.get("generate", self.generate),
+                             fields.get("children", self.children))
+
+    def __init__(self, *args, **kwargs):
+        raise TypeError("FrozenSOs are made with FrozenSO.make() or "
+                        "SO.freeze()")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenSO is immutable; copy() it first")
+
+    def __delattr__(self, name):
+        raise AttributeError("FrozenSO is immutable; copy() it first")
+
+    def __reduce__(self):
+        # Re-intern on the way back in (for pickling/copying); the phase
+        # lexicon gets worked out afresh
+        return (rebuild_frozen,
+                (self.category, self.label, self.lexicon, self.features,
+                 self.subcat, self.generate, self.children))
+
+    def freeze(self):
+        return self
+
+    def last_phase_lexicon(self):
+        """
+        As SO.last_phase_lexicon(), but only worked out once (from the
+        children's cached values) and then kept on the SO, so this is O(1).
+        The cached value is thrown out if config.phase_heads is replaced
+        (e.g., when config is reloaded).
+        Returns a frozenset of the relevant lexica
+        :return:
+        """
+        if self.cached_phase_heads is not config.phase_heads:
+            set_attribute = object.__setattr__
+            set_attribute(self, "cached_phase_lexicon",
+                          frozenset(SO.last_phase_lexicon(self)))
+            set_attribute(self, "cached_phase_heads", config.phase_heads)
+            # (The signature includes the phase lexicon)
+            set_attribute(self, "cached_signature_id", None)
+
+        return self.cached_phase_lexicon
+
+    def signature_id(self):
+        """
+        As SO.signature_id(), but only looked up once (until
+        config.phase_heads is replaced)
+        :return:
+        """
+        phase_lexicon = self.last_phase_lexicon()
+        if self.cached_signature_id is None:
+            signature = (self.category, self.label, self.features,
+                         self.subcat, phase_lexicon)
+            object.__setattr__(self, "cached_signature_id",
+                               intern_id(signature_ids, signature))
+        return self.cached_signature_id
+
+    def canonical(self):
+        """
+        As SO.canonical(), but only worked out once (from the children's
+        canonical forms).
+        Canonical forms are hash-consed like any other FrozenSO, so they can
+        be compared by identity, and go away once nothing is using them.
+        :return:
+        """
+        canonical = self.cached_canonical
+        if canonical is None:
+            canonical = FrozenSO.make(
+                category=self.category,
+                label=self.label,
+                lexicon=self.lexicon,
+                features=self.features,
+                subcat=(),
+                generate=(),
+                children=tuple([child.canonical()
+                                for child in self.children]))
+            # (An SO that is its own canonical form just says so, rather
+            # than keeping a reference to itself)
+            object.__setattr__(self, "cached_canonical",
+                               True if canonical is self else canonical)
+        elif canonical is True:
+            canonical = self
+        return canonical
+
+    def tree_size(self):
+        """
+        Rough number of bytes in the merged part of the tree under (and
+        including) this SO: Each merged SO, its subcat and children tuples,
+        its phase lexicon set and its hash-cons table entry.
+        Lexical items (SOs without children) count as nothing, since the
+        lexica keep them alive anyway; features are interned and shared.
+        SOs that turn up more than once under it are counted each time, so
+        this errs on the high side.  Worked out once, from the children's
+        cached values.
+        :return:
+        """
+        if self.cached_size is None:
+            size = 0
+            if len(self.children) > 0:
+                size = (sys.getsizeof(self) + sys.getsizeof(self.subcat) +
+                        sys.getsizeof(self.children) +
+                        sys.getsizeof(self.cached_phase_lexicon) +
+                        table_entry_size)
+                for child in self.children:
+                    size += child.tree_size()
+            object.__setattr__(self, "cached_size", size)
+        return self.cached_size
+
+
+# Interned feature sets: Every distinct set of features is held by a single
+# frozenset
+feature_sets = {}
+
+
+# Every distinct signature seen so far (see SO.signature_id()), mapped to its
+# ID
+signature_ids = {}
+
+
+# Rough bytes each FrozenSO costs in the hash-cons table (see
+# FrozenSO.tree_size()): Its key tuple, plus an allowance for the weak
+# reference and the dictionary slot
+table_entry_size = sys.getsizeof((None,) * 7) + 128
+
+
+# The hash-cons table and the ID table are shared by every thread (e.g.,
+# the workers of a thread-based app.parallel.ParseExecutor), and adding to
+# them takes more than one step
+table_lock = threading.Lock()
+
+
+def intern_id(ids, key):
+    """
+    Returns the ID for the given key in one of the ID tables, handing out
+    the next one if the key is new
+    :param ids:
+    :param key:
+    :return:
+    """
+    with table_lock:
+        return ids.setdefault(key, len(ids))
+
+
+def intern_features(features):
+    """
+    Returns the shared frozenset holding the given features
+    :param features:
+    :return:
+    """
+    features = frozenset(features)
+    return feature_sets.setdefault(features, features)
+
+
+def rebuild_frozen(category, label, lexicon, features, subcat, generate,
+                   children):
+    """
+    FrozenSO.make(), for features that might not have been interned yet
+    (e.g., when unpickling)
+    :return:
+    """
+    return FrozenSO.make(category, label, lexicon, intern_features(features),
+                         subcat, generate, children)
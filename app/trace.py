@@ -0,0 +1,203 @@
+# Zechy Wong
+# 23 May 2017
+# Code-switching parser
+# ---------------------
+# Parse tracing
+# - Records what the parser gets up to (shifts, merge attempts and failures,
+#   rejected lexicon switches, retries) as compact records
+# - Switched off by default: The parser binds `active` to a local and checks
+#   it against None, so there is next to nothing to pay when no tracer is
+#   set up
+# - Records go to a ring buffer (the most recent ones are kept in memory) or
+#   are appended to a file
+
+from __future__ import print_function
+
+import time
+from collections import deque
+
+import config
+
+# Trace levels
+# EVENTS: Things that go wrong -- Merge failures, lexicon switches rejected at
+#   non-phase heads, retries, lexical arrays thrown out by the prefilter or
+#   already known (from the check_parse() memo) to go nowhere, duplicate
+#   parses dropped
+# STEPS: Every shift and merge attempt as well
+EVENTS = 1
+STEPS = 2
+levels = {"events": EVENTS, "steps": STEPS}
+
+# The level each event type is recorded at
+event_levels = {
+    "shift": STEPS,
+    "merge-attempt": STEPS,
+    "merge-fail": EVENTS,
+    "phase-switch-reject": EVENTS,
+    "retry": EVENTS,
+    "memo-fail": EVENTS,
+    "prefilter-discard": EVENTS,
+    "duplicate-parse": EVENTS
+}
+
+# The tracer currently in use, or None if tracing is switched off
+active = None
+
+
+class Tracer(object):
+    """
+    Filters trace events by level and passes them on to a sink as
+    (timestamp, event, fields) records
+    """
+
+    def __init__(self, level=EVENTS, sink=None):
+        """
+        :param level: EVENTS or STEPS
+        :param sink: A RingBuffer or FileSink (default: a new RingBuffer)
+        """
+        if sink is None:
+            sink = RingBuffer()
+
+        self.level = level
+        self.sink = sink
+        self.wanted = frozenset(event for event, event_level
+                                in event_levels.items()
+                                if event_level <= level)
+
+    def emit(self, event, *fields):
+        """
+        Record an event, if it is at or below our level.
+        The fields are kept as they are (SOs are immutable by the time the
+        parser sees them), and only formatted when they are written out.
+        :param event:
+        :param fields:
+        :return:
+        """
+        if event in self.wanted:
+            self.sink.write((time.time(), event, fields))
+
+
+class RingBuffer(object):
+    """
+    Keeps the most recent `size` records in memory
+    """
+
+    def __init__(self, size=10000):
+        self.records = deque(maxlen=size)
+
+    def write(self, record):
+        self.records.append(record)
+
+    def recent(self, count=None):
+        """
+        The last `count` records (or all of them), oldest first
+        :param count:
+        :return:
+        """
+        records = list(self.records)
+        if count is not None:
+            records = records[-count:]
+        return records
+
+    def clear(self):
+        self.records.clear()
+
+    def close(self):
+        pass
+
+
+class FileSink(object):
+    """
+    Appends each record to a file as a line of tab-separated fields.
+    The file is flushed at least every `flush_interval` seconds (while
+    records are coming in), so that a trace survives the process being
+    killed, give or take the last interval.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, "a")
+        self.flush_interval = flush_interval
+        # (So that the first record goes straight out)
+        self.last_flush = 0
+
+    def write(self, record):
+        self.file.write(format_record(record))
+        self.file.write("\n")
+
+        now = record[0]
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def recent(self, count=None):
+        # The records are in the file, not in memory
+        return []
+
+    def clear(self):
+        pass
+
+    def close(self):
+        self.file.close()
+
+
+def format_record(record):
+    """
+    Turn a trace record into a single line of text
+    :param record:
+    :return:
+    """
+    timestamp, event, fields = record
+    return "\t".join(["{:.6f}".format(timestamp), event] +
+                     [format_field(field) for field in fields])
+
+
+def format_field(field):
+    """
+    SOs are shown in their bracket notation; anything else as a string
+    :param field:
+    :return:
+    """
+    if hasattr(field, "to_brackets"):
+        return field.to_brackets()
+    return str(field)
+
+
+def start(level="events", path=None, size=10000):
+    """
+    Switch tracing on (replacing any existing tracer)
+    :param level: (events|steps)
+    :param path: File to append records to; if None, records are kept in a
+        ring buffer instead
+    :param size: Records to keep in the ring buffer
+    :return: The new tracer
+    """
+    global active
+
+    if level not in levels:
+        raise ValueError("Unknown trace level: {}".format(level))
+
+    stop()
+    if path is None:
+        sink = RingBuffer(size)
+    else:
+        sink = FileSink(path)
+
+    active = Tracer(levels[level], sink)
+    return active
+
+
+def stop():
+    """
+    Switch tracing off
+    :return:
+    """
+    global active
+
+    if active is not None:
+        active.sink.close()
+    active = None
+
+
+if config.trace_level is not None:
+    start(config.trace_level, config.trace_file)
@@ -0,0 +1,14 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Benchmarks
+# - bench.micro: Timings for the individual building blocks of a parse
+#   (tokenise, lexicon lookups, subcat matching, merging, ...)
+# - bench.sentences: Generates grammatical and ungrammatical code-switched
+#   sentences from the live lexica in config.lexica
+# - bench.scaling: Parses generated sentences of increasing length, for
+#   curves of time/memory against token count and lexical array count
+# Run `python2 -m bench --help` from the top-level directory for the command
+# line interface; results are saved as JSON so that two commits can be
+# compared
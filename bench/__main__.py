@@ -0,0 +1,210 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Benchmark command line interface
+# `python2 -m bench run --out results.json` to run the benchmarks
+# `python2 -m bench compare old.json new.json` to compare two runs
+# `python2 -m bench sentences --length 8` to look at generated sentences
+# `python2 -m bench check` to check that the engines and the prefilter agree
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import config
+import bench.check
+import bench.micro
+import bench.scaling
+from bench.sentences import SentenceGenerator
+
+
+def parse_lengths(lengths):
+    """
+    "2-10" -> [2, ..., 10]; "4,8,16" -> [4, 8, 16]
+    :param lengths:
+    :return:
+    """
+    if "-" in lengths:
+        first, last = lengths.split("-")
+        return list(range(int(first), int(last) + 1))
+    return [int(length) for length in lengths.split(",")]
+
+
+def current_commit():
+    """
+    The git commit we are running from, if we can tell
+    :return:
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"]).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_main(options):
+    generator = SentenceGenerator(seed=options.seed,
+                                  switch_rate=options.switch_rate,
+                                  ambiguity=options.ambiguity)
+
+    results = {"meta": {"commit": current_commit(),
+                        "python": platform.python_version(),
+                        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "seed": options.seed,
+                        "switch_rate": options.switch_rate,
+                        "ambiguity": options.ambiguity}}
+
+    if not options.scaling_only:
+        sys.stderr.write("Running microbenchmarks...\n")
+        sentences = [generator.grammatical(length) for length in range(2, 9)]
+        sentences += [generator.ungrammatical(length)
+                      for length in range(2, 9)]
+        results["micro"] = bench.micro.run_micro(
+            [sentence for sentence in sentences if sentence is not None],
+            number=options.number)
+
+    if not options.micro_only:
+        sys.stderr.write("Running scaling benchmarks...\n")
+        results["scaling"] = bench.scaling.run_scaling(
+            generator,
+            parse_lengths(options.lengths),
+            per_length=options.per_length,
+            engines=options.engines.split(","),
+            timeout=options.timeout,
+            memory=not options.no_memory)
+
+    with open(options.out, "w") as out_file:
+        json.dump(results, out_file, indent=2, sort_keys=True)
+
+    for name, seconds in results.get("micro", {}).items():
+        print("{:<40} {:10.3f} us".format(name, seconds * 1e6))
+    for point in results.get("scaling", {}).get("by_tokens", []):
+        print("{:<6} {:<14} {:>3} tokens: {:10.3f} ms".format(
+            point["engine"],
+            "grammatical" if point["grammatical"] else "ungrammatical",
+            point["x"], point["time"] * 1000))
+
+
+def compare_main(options):
+    with open(options.old) as old_file:
+        old = json.load(old_file)
+    with open(options.new) as new_file:
+        new = json.load(new_file)
+
+    for line in bench.scaling.compare(old, new, options.threshold):
+        print(line)
+
+
+def sentences_main(options):
+    generator = SentenceGenerator(seed=options.seed,
+                                  switch_rate=options.switch_rate,
+                                  ambiguity=options.ambiguity)
+    for _ in range(options.count):
+        if options.ungrammatical:
+            sentence = generator.ungrammatical(options.length)
+        else:
+            sentence = generator.grammatical(options.length)
+        if sentence is not None:
+            print(sentence)
+
+
+def check_main(options):
+    generator = SentenceGenerator(seed=options.seed,
+                                  switch_rate=options.switch_rate,
+                                  ambiguity=options.ambiguity)
+    checked, failures = bench.check.run_check(
+        generator, parse_lengths(options.lengths),
+        per_length=options.per_length)
+
+    for sentence, problems in failures:
+        print(sentence)
+        for problem in problems:
+            print("  {}".format(problem))
+    print("{} sentences checked, {} with differences".format(checked,
+                                                            len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="python2 -m bench",
+        description="Parser benchmarks")
+    commands = arg_parser.add_subparsers(dest="command")
+
+    generator_options = argparse.ArgumentParser(add_help=False)
+    generator_options.add_argument("--seed", type=int, default=0)
+    generator_options.add_argument("--switch-rate", type=float, default=0.5,
+                                   help="chance of switching lexicon "
+                                        "between tokens")
+    generator_options.add_argument("--ambiguity", type=float, default=0.0,
+                                   help="> 0 favours tokens with more "
+                                        "expansions, < 0 fewer")
+
+    run_parser = commands.add_parser("run", parents=[generator_options],
+                                     help="run the benchmarks")
+    run_parser.add_argument("--out", required=True,
+                            help="file to save the results (JSON) to")
+    run_parser.add_argument("--lengths", default="2-10",
+                            help="sentence lengths, as 'first-last' or a "
+                                 "comma-separated list")
+    run_parser.add_argument("--per-length", type=int, default=5,
+                            help="sentences of each kind per length")
+    run_parser.add_argument("--engines", default="scan,chart")
+    run_parser.add_argument("--timeout", type=float, default=10,
+                            help="time budget per parse, in seconds")
+    run_parser.add_argument("--number", type=int, default=20000,
+                            help="calls per microbenchmark run")
+    run_parser.add_argument("--no-memory", action="store_true",
+                            help="skip the peak memory measurements")
+    run_parser.add_argument("--micro-only", action="store_true")
+    run_parser.add_argument("--scaling-only", action="store_true")
+
+    compare_parser = commands.add_parser("compare",
+                                         help="compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="flag changes larger than this "
+                                     "fraction")
+
+    sentences_parser = commands.add_parser("sentences",
+                                           parents=[generator_options],
+                                           help="print generated sentences")
+    sentences_parser.add_argument("--length", type=int, default=6)
+    sentences_parser.add_argument("--count", type=int, default=10)
+    sentences_parser.add_argument("--ungrammatical", action="store_true")
+
+    check_parser = commands.add_parser("check",
+                                       parents=[generator_options],
+                                       help="check that the engines and the "
+                                            "prefilter agree")
+    check_parser.add_argument("--lengths", default="2-6",
+                              help="sentence lengths, as 'first-last' or a "
+                                   "comma-separated list")
+    check_parser.add_argument("--per-length", type=int, default=5,
+                              help="sentences of each kind per length")
+
+    options = arg_parser.parse_args(args)
+
+    # Keep the parser quiet
+    config.debug = False
+
+    if options.command == "run":
+        run_main(options)
+    elif options.command == "compare":
+        compare_main(options)
+    elif options.command == "sentences":
+        sentences_main(options)
+    elif options.command == "check":
+        check_main(options)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
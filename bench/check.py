@@ -0,0 +1,101 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Regression check for the parsing engines
+# - Parses generated sentences (see bench.sentences) several ways that should
+#   agree, and reports every sentence where they don't:
+#   - The scan engine with config.prefilter on and off (same parses, same
+#     order: The prefilter only skips lexical arrays that can't parse)
+#   - The chart engine against the scan engine (same parses, in any order)
+# - Every parse runs from cold caches, so the answers can't come from an
+#   earlier run with the other settings
+
+from __future__ import print_function, division
+
+from collections import Counter
+
+import config
+import app.parser
+from bench.scaling import cold_caches
+
+
+def parse_key(parse):
+    """
+    What has to match between two parses for them to count as the same
+    :param parse:
+    :return:
+    """
+    return parse.to_brackets(), repr(parse)
+
+
+def all_parses(sentence, engine, prefilter=True):
+    """
+    Every parse of the sentence with the given engine, as parse_key()s, in
+    the order they came out
+    :param sentence:
+    :param engine:
+    :param prefilter: Value for config.prefilter during the parse
+    :return:
+    """
+    old_prefilter = config.prefilter
+    config.prefilter = prefilter
+    try:
+        with cold_caches():
+            return [parse_key(parse)
+                    for parse in app.parser.parse_string(sentence,
+                                                         engine=engine)]
+    finally:
+        config.prefilter = old_prefilter
+
+
+def check_sentence(sentence):
+    """
+    Parse the sentence every way and describe any disagreements
+    :param sentence:
+    :return: A list of problems (empty if everything agreed)
+    """
+    problems = []
+
+    scan = all_parses(sentence, "scan")
+    unfiltered = all_parses(sentence, "scan", prefilter=False)
+    if scan != unfiltered:
+        problems.append(
+            "scan: {} parses with the prefilter, {} without{}".format(
+                len(scan), len(unfiltered),
+                " (same parses, different order)"
+                if Counter(scan) == Counter(unfiltered) else ""))
+
+    chart = all_parses(sentence, "chart")
+    if Counter(chart) != Counter(scan):
+        missing = sum((Counter(scan) - Counter(chart)).values())
+        extra = sum((Counter(chart) - Counter(scan)).values())
+        problems.append(
+            "chart: {} parses, scan: {} ({} missing from chart, "
+            "{} only in chart)".format(len(chart), len(scan), missing,
+                                       extra))
+
+    return problems
+
+
+def run_check(generator, lengths, per_length=5):
+    """
+    Check grammatical and ungrammatical sentences of each length
+    :param generator: A bench.sentences.SentenceGenerator
+    :param lengths:
+    :param per_length: Sentences of each kind per length
+    :return: (Number of sentences checked, [(sentence, [problem])])
+    """
+    checked = 0
+    failures = []
+    for length in lengths:
+        for _ in range(per_length):
+            for sentence in (generator.grammatical(length),
+                             generator.ungrammatical(length)):
+                if sentence is None:
+                    continue
+                checked += 1
+                problems = check_sentence(sentence)
+                if problems:
+                    failures.append((sentence, problems))
+    return checked, failures
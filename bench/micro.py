@@ -0,0 +1,182 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Microbenchmarks
+# - Times the individual building blocks of a parse over inputs drawn from
+#   the live lexica, reporting the best time per call over several repeats
+
+from __future__ import print_function, division
+
+import timeit
+from collections import OrderedDict
+
+import config
+import app.lexical_array
+import app.parser
+from app.subcat import subcat_match
+from app.syntactic_object import SO
+
+
+def time_calls(func, make_calls, repeat=5):
+    """
+    Best time per call of `func`, over `repeat` runs through the argument
+    tuples returned by make_calls() (which is called, untimed, before each
+    run, so that functions that use up their arguments get fresh ones)
+    :param func:
+    :param make_calls:
+    :param repeat:
+    :return: Seconds per call
+    """
+    best = None
+    for _ in range(repeat):
+        calls = make_calls()
+        start_time = timeit.default_timer()
+        for args in calls:
+            func(*args)
+        elapsed = timeit.default_timer() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(calls)
+
+
+def repeated(calls, number):
+    """
+    Cycle through the given argument tuples until there are `number` of them
+    :param calls:
+    :param number:
+    :return:
+    """
+    return [calls[idx % len(calls)] for idx in range(number)]
+
+
+def lexical_sos(lexica):
+    """
+    Every (frozen) SO that the lexica can produce
+    :param lexica:
+    :return:
+    """
+    sos = []
+    for lexicon in lexica:
+        for token in sorted(lexicon.lexicon):
+            for token_parse in lexicon.lookup_token(token) or []:
+                sos.extend(token_parse)
+    return sos
+
+
+def merge_calls(parses):
+    """
+    Recover the merge() arguments that built each parse: At every node, the
+    head is the child that projects (same category) and whose subcat list,
+    minus its first entry, is the node's subcat list
+    :param parses:
+    :return:
+    """
+    calls = []
+    pending = list(parses)
+    while pending:
+        so = pending.pop()
+        if len(so.children) != 2:
+            continue
+        pending.extend(so.children)
+
+        left, right = so.children
+        if (left.category == so.category and len(left.subcat) > 0 and
+                left.subcat[0][0] == "right" and
+                tuple(left.subcat[1:]) == tuple(so.subcat)):
+            calls.append((left, right, "left", left.subcat[1:]))
+        else:
+            calls.append((right, left, "right", right.subcat[1:]))
+    return calls
+
+
+def run_micro(sentences, number=20000, repeat=5, lexica=None):
+    """
+    Time each building block, over inputs drawn from the given sentences and
+    lexica
+    :param sentences: Sample sentences, which should include some
+        grammatical ones (for merge() and last_phase_lexicon())
+    :param number: Calls per run
+    :param repeat: Runs per benchmark (the best one counts)
+    :param lexica: Default: config.lexica
+    :return: Benchmark name -> seconds per call
+    """
+    if lexica is None:
+        lexica = config.lexica
+
+    results = OrderedDict()
+
+    # Tokenisation
+    calls = repeated([(sentence,) for sentence in sentences], number)
+    results["tokenise"] = time_calls(app.lexical_array.tokenise,
+                                     lambda: calls, repeat)
+
+    # Lexicon lookups: Every token in every lexicon, hits and misses alike
+    tokens = sorted(set(token for lexicon in lexica
+                        for token in lexicon.lexicon))
+    calls = repeated([(lexicon, token) for lexicon in lexica
+                      for token in tokens], number)
+    results["lookup_token"] = time_calls(
+        lambda lexicon, token: lexicon.lookup_token(token),
+        lambda: calls, repeat)
+
+    # Expanding a token from scratch (i.e., a lookup without compile())
+    # (These are much slower, so they get fewer calls)
+    entries = [(lexicon, token) for lexicon in lexica
+               for token in sorted(lexicon.lexicon)]
+    calls = repeated(entries, number // 10)
+    results["expand_token"] = time_calls(
+        lambda lexicon, token: lexicon.expand_token(token),
+        lambda: calls, repeat)
+
+    # Rules and generating functional heads, on the lexical entries
+    rule_calls = repeated([(lexicon, [(base_so,)
+                                      for base_so in lexicon.lexicon[token]])
+                           for lexicon, token in entries], number // 10)
+    results["apply_rules"] = time_calls(
+        lambda lexicon, token_parse_list:
+        lexicon.apply_rules(token_parse_list),
+        lambda: rule_calls, repeat)
+
+    calls = [(lexicon, lexicon.apply_rules(token_parse_list))
+             for lexicon, token_parse_list in rule_calls]
+    results["generate_items"] = time_calls(
+        lambda lexicon, token_parse_list:
+        lexicon.generate_items(token_parse_list),
+        lambda: calls, repeat)
+
+    # Subcat matching: Every criterion in the lexica against every SO
+    sos = lexical_sos(lexica)
+    criteria = [criterion for so in sos for _, criterion in so.subcat]
+    calls = repeated([(criterion, so) for criterion in criteria
+                      for so in sos], number)
+    results["subcat_match"] = time_calls(subcat_match, lambda: calls,
+                                         repeat)
+
+    # Merging and phase lexica, over the parses of the sample sentences
+    parses = []
+    for sentence in sentences:
+        parses.extend(app.parser.parse_string(sentence, engine="chart"))
+
+    if parses:
+        calls = repeated(merge_calls(parses), number)
+        results["merge"] = time_calls(
+            lambda head, complement, head_direction, new_subcat:
+            app.parser.merge(head=head,
+                             complement=complement,
+                             head_direction=head_direction,
+                             new_subcat=new_subcat),
+            lambda: calls, repeat)
+
+        # Frozen SOs cache their phase lexicon; thawed (mutable) copies of
+        # the same trees work it out from scratch every time
+        calls = repeated([(parse,) for parse in parses], number)
+        results["last_phase_lexicon"] = time_calls(
+            lambda so: so.last_phase_lexicon(), lambda: calls, repeat)
+
+        thawed = [(SO.from_dict(parse.to_dict()),) for parse in parses]
+        calls = repeated(thawed, number)
+        results["last_phase_lexicon (unfrozen)"] = time_calls(
+            lambda so: so.last_phase_lexicon(), lambda: calls, repeat)
+
+    return results
@@ -0,0 +1,234 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Scaling benchmarks
+# - Parses generated sentences of increasing length with each engine, and
+#   summarises time and peak memory against token count and against the
+#   number of lexical arrays (combinations) the sentence maps to
+# - compare() lines up two sets of results (e.g., from two commits)
+
+from __future__ import print_function, division
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import app.lexical_array
+import app.parse_cache
+import app.parser
+import app.stats
+from bench.sentences import combination_count
+
+
+@contextmanager
+def cold_caches():
+    """
+    Run the enclosed parse from scratch: The process-wide check_parse() memo
+    and merge cache are cleared first (the sentence generator has usually
+    parsed the sentence already, and the memory run follows the timed run),
+    and the parse cache is switched off for the duration
+    :return:
+    """
+    parse_cache = app.parse_cache.active
+    app.parse_cache.active = None
+    app.parser.memo.clear()
+    app.parser.merge_cache.clear()
+    try:
+        yield
+    finally:
+        app.parse_cache.active = parse_cache
+
+
+def measure_sentence(sentence, engine, timeout=None, memory=True):
+    """
+    Parse a sentence to completion, timing it, and (in a separate run, since
+    tracking allocations slows everything down) measuring its peak memory.
+    Both runs start with cold caches (see cold_caches())
+    :param sentence:
+    :param engine:
+    :param timeout: Time budget for the parse, in seconds
+    :param memory:
+    :return: A JSON-friendly record
+    """
+    with cold_caches():
+        start_time = time.time()
+        deadline = None
+        if timeout is not None:
+            deadline = start_time + timeout
+        parses = len(list(app.parser.parse_string(sentence, engine=engine,
+                                                  deadline=deadline)))
+        elapsed = time.time() - start_time
+
+    record = {"sentence": sentence,
+              "engine": engine,
+              "tokens": len(app.lexical_array.tokenise(sentence)),
+              "combinations": combination_count(sentence),
+              "parses": parses,
+              "time": elapsed,
+              "timed_out": deadline is not None and time.time() > deadline,
+              "peak_memory": None}
+
+    if memory:
+        stats = app.stats.ParseStats(memory=True)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with cold_caches():
+            for _ in app.parser.parse_string(sentence, engine=engine,
+                                             deadline=deadline, stats=stats):
+                pass
+        record["peak_memory"] = stats.peak_memory
+        record["memory_source"] = stats.memory_source
+
+    return record
+
+
+def combinations_bucket(combinations):
+    """
+    Group combination counts by powers of two
+    :param combinations:
+    :return:
+    """
+    bucket = 1
+    while bucket < combinations:
+        bucket *= 2
+    return bucket
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def curve(points, key):
+    """
+    Summarise the measurements as a curve: For each engine and
+    grammaticality, the median time and largest peak memory (or RSS change,
+    on Python 2 -- See app.stats) at each value of `key`
+    :param points:
+    :param key: A function from a measurement to its x value
+    :return: List of curve points, sorted
+    """
+    groups = OrderedDict()
+    for point in points:
+        group = (point["engine"], point["grammatical"], key(point))
+        groups.setdefault(group, []).append(point)
+
+    summary = []
+    for (engine, grammatical, x), group in sorted(groups.items()):
+        memory = [point["peak_memory"] for point in group
+                  if point["peak_memory"] is not None]
+        summary.append({"engine": engine,
+                        "grammatical": grammatical,
+                        "x": x,
+                        "samples": len(group),
+                        "time": median([point["time"] for point in group]),
+                        "peak_memory": max(memory) if memory else None})
+    return summary
+
+
+def run_scaling(generator, lengths, per_length=5, engines=("scan", "chart"),
+                timeout=10, memory=True):
+    """
+    Generate `per_length` grammatical and ungrammatical sentences at each
+    length and measure each engine on them
+    :param generator: A bench.sentences.SentenceGenerator
+    :param lengths: Sentence lengths, in vocabulary items
+    :param per_length:
+    :param engines:
+    :param timeout: Time budget per parse, in seconds
+    :param memory: Measure peak memory as well
+    :return:
+    """
+    points = []
+    for length in lengths:
+        for grammatical in (True, False):
+            for _ in range(per_length):
+                if grammatical:
+                    sentence = generator.grammatical(length)
+                else:
+                    sentence = generator.ungrammatical(length)
+                if sentence is None:
+                    continue
+
+                for engine in engines:
+                    point = measure_sentence(sentence, engine, timeout, memory)
+                    point["grammatical"] = grammatical
+                    points.append(point)
+
+    return {"points": points,
+            "by_tokens": curve(points, lambda point: point["tokens"]),
+            "by_combinations": curve(points,
+                                     lambda point: combinations_bucket(
+                                         point["combinations"]))}
+
+
+def ratio_line(name, old, new, threshold):
+    """
+    One line of a comparison: Old and new values, and how much slower (or
+    faster) the new one is
+    :param name:
+    :param old:
+    :param new:
+    :param threshold: Ratios beyond 1 +/- this are flagged
+    :return:
+    """
+    if not old:
+        return "  {:<40} {:>12} {:>12}".format(name, "-", "-")
+
+    ratio = new / old
+    flag = ""
+    if ratio > 1 + threshold:
+        flag = "slower"
+    elif ratio < 1 - threshold:
+        flag = "faster"
+    return "  {:<40} {:>12.6g} {:>12.6g} {:>7.2f}x {}".format(name, old, new,
+                                                              ratio, flag)
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Line up two sets of benchmark results
+    :param old: Results, as saved by `python2 -m bench run`
+    :param new:
+    :param threshold: Changes of less than this fraction are not flagged
+    :return: Lines of text
+    """
+    lines = ["Old: {}".format(old.get("meta", {}).get("commit")),
+             "New: {}".format(new.get("meta", {}).get("commit"))]
+
+    old_micro = old.get("micro", {})
+    new_micro = new.get("micro", {})
+    if old_micro or new_micro:
+        lines.append("Microbenchmarks (seconds per call):")
+        for name in old_micro:
+            if name in new_micro:
+                lines.append(ratio_line(name, old_micro[name],
+                                        new_micro[name], threshold))
+
+    for curve_name in ("by_tokens", "by_combinations"):
+        old_curve = old.get("scaling", {}).get(curve_name, [])
+        new_curve = new.get("scaling", {}).get(curve_name, [])
+        new_points = dict(((point["engine"], point["grammatical"],
+                            point["x"]), point) for point in new_curve)
+        if not old_curve or not new_points:
+            continue
+
+        lines.append("Median time, {} (seconds):".format(
+            curve_name.replace("_", " ")))
+        for point in old_curve:
+            key = (point["engine"], point["grammatical"], point["x"])
+            if key not in new_points:
+                continue
+            name = "{} {} {}".format(
+                point["engine"],
+                "grammatical" if point["grammatical"] else "ungrammatical",
+                point["x"])
+            lines.append(ratio_line(name, point["time"],
+                                    new_points[key]["time"], threshold))
+
+    return lines
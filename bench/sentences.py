@@ -0,0 +1,175 @@
+# Zechy Wong
+# 25 May 2017
+# Code-switching parser
+# ---------------------
+# Synthetic code-switched sentences for benchmarking
+# - Built from whatever is in the live lexica, so the benchmarks keep up with
+#   lexicon edits
+# - Grammatical sentences are grown from short grammatical seeds by inserting
+#   tokens, keeping only insertions that the parser still accepts
+
+from __future__ import print_function, division
+
+import random
+
+import config
+import app.lexical_array
+import app.parser
+
+
+class SentenceGenerator(object):
+    """
+    Generates code-switched sentences of a given length (in vocabulary items;
+    multi-word tokens count once), mixing the vocabularies of the lexica.
+    """
+
+    def __init__(self, lexica=None, seed=0, switch_rate=0.5, ambiguity=0.0,
+                 engine="chart"):
+        """
+        :param lexica: Default: config.lexica
+        :param seed: For the random number generator
+        :param switch_rate: Chance of switching lexicon between one token and
+            the next (for ungrammatical sentences)
+        :param ambiguity: Tokens are picked with weight (number of
+            expansions) ** ambiguity -- 0 picks uniformly, higher values
+            favour more ambiguous tokens, negative values less ambiguous ones
+        :param engine: Parsing engine used to decide what is grammatical
+        """
+        if lexica is None:
+            lexica = config.lexica
+
+        self.random = random.Random(seed)
+        self.switch_rate = switch_rate
+        self.engine = engine
+
+        # Lexicon ID -> [(token, weight)]
+        self.vocabulary = {}
+        for lexicon in lexica:
+            entries = []
+            for token in sorted(lexicon.lexicon):
+                expansions = lexicon.lookup_token(token) or []
+                entries.append((token, max(len(expansions), 1) ** ambiguity))
+            if entries:
+                self.vocabulary[lexicon.id] = entries
+        self.lexicon_ids = sorted(self.vocabulary)
+
+        # Short grammatical sentences (as token lists) to grow from
+        self.seeds = []
+
+    def is_grammatical(self, tokens):
+        """
+        Does the parser find at least one parse for these tokens?
+        :param tokens:
+        :return:
+        """
+        for _ in app.parser.parse_string(" ".join(tokens), engine=self.engine,
+                                         max_parses=1):
+            return True
+        return False
+
+    def pick_token(self, lexicon_id=None):
+        """
+        Pick a random token, from the given lexicon or any of them
+        :param lexicon_id:
+        :return:
+        """
+        if lexicon_id is None:
+            lexicon_id = self.random.choice(self.lexicon_ids)
+
+        entries = self.vocabulary[lexicon_id]
+        point = self.random.uniform(0, sum(weight for _, weight in entries))
+        for token, weight in entries:
+            point -= weight
+            if point <= 0:
+                return token
+        return entries[-1][0]
+
+    def random_tokens(self, length):
+        """
+        A random token sequence, switching lexicon with probability
+        switch_rate at each step
+        :param length:
+        :return:
+        """
+        lexicon_id = self.random.choice(self.lexicon_ids)
+        tokens = []
+        for _ in range(length):
+            if tokens and self.random.random() < self.switch_rate:
+                lexicon_id = self.random.choice(self.lexicon_ids)
+            tokens.append(self.pick_token(lexicon_id))
+        return tokens
+
+    def ungrammatical(self, length, tries=1000):
+        """
+        A random sentence that the parser rejects, or None if none turned up
+        :param length:
+        :param tries:
+        :return:
+        """
+        for _ in range(tries):
+            tokens = self.random_tokens(length)
+            if not self.is_grammatical(tokens):
+                return " ".join(tokens)
+        return None
+
+    def find_seeds(self, tries=5000, max_length=3):
+        """
+        Collect short grammatical sentences by trial and error
+        :param tries:
+        :param max_length:
+        :return:
+        """
+        found = set(tuple(seed) for seed in self.seeds)
+        for _ in range(tries):
+            tokens = self.random_tokens(self.random.randint(2, max_length))
+            if tuple(tokens) not in found and self.is_grammatical(tokens):
+                found.add(tuple(tokens))
+                self.seeds.append(tokens)
+
+    def grammatical(self, length, tries=50, insert_tries=200):
+        """
+        A sentence that the parser accepts, grown to the given length from a
+        grammatical seed one inserted token at a time.
+        Returns None if no such sentence turned up (the lexica may simply not
+        allow sentences that long)
+        :param length:
+        :param tries: Number of times to start over from a new seed
+        :param insert_tries: Insertions to try at each step before giving up
+            on the current sentence
+        :return:
+        """
+        if not self.seeds:
+            self.find_seeds()
+        seeds = [seed for seed in self.seeds if len(seed) <= length]
+        if not seeds:
+            return None
+
+        for _ in range(tries):
+            tokens = list(self.random.choice(seeds))
+            while len(tokens) < length:
+                for _ in range(insert_tries):
+                    candidate = list(tokens)
+                    candidate.insert(self.random.randint(0, len(tokens)),
+                                     self.pick_token())
+                    if self.is_grammatical(candidate):
+                        tokens = candidate
+                        break
+                else:
+                    break
+
+            if len(tokens) == length:
+                return " ".join(tokens)
+
+        return None
+
+
+def combination_count(sentence):
+    """
+    The number of lexical arrays the sentence maps to (0 for OOV input)
+    :param sentence:
+    :return:
+    """
+    lattice = app.lexical_array.enumerate_input(sentence)
+    if not lattice:
+        return 0
+    return lattice.count()
@@ -9,15 +9,49 @@ import lexicon
 # Print debugging output?  (Can be pretty verbose)
 debug = True
 
+# Trace the parser's steps (see app.trace)?
+# None to switch tracing off, "events" for failures and retries only, or
+# "steps" for every shift and merge attempt as well
+trace_level = None
+# File to append trace records to; None keeps the most recent records in
+# memory instead (see the REPL's 'trace' command)
+trace_file = None
+
+# Keep the parses of sentences we have seen before in a file (see
+# app.parse_cache)?  None to switch caching off; a path to an SQLite file
+# (created if needed) to switch it on
+parse_cache_file = None
+# Bytes of parses to keep in the file, at most
+parse_cache_size = 64 * 1024 * 1024
+
+# Parsing engine:
+# "scan" walks each lexical array SO-by-SO (app.parser.check_parse)
+# "chart" fills in a chart of constituents per span (app.chart)
+engine = "scan"
+
+# Throw out lexical arrays that could never parse before the scan engine gets
+# to them? (See app.prefilter)
+prefilter = True
+
+# Drop parses that are structurally identical to one already found (i.e.,
+# that would be written out the same way)? (See app.parser.Deduplicator)
+deduplicate_parses = True
+
 # Phase boundaries:
 # Lexicon switch is only allowed if the head belongs to one of these categories
 # (i.e., the head can be in one language and the complement another)
 # Phonologically null elements will remain indeterminate w.r.t. lexicon until
 # a phase boundary is reached, at which time the complement SO hierarchy will
 # be checked for consistency
-phase_heads = ["v", "c"]
+# (Held as a frozenset: SOs cache their last phase lexicon against this very
+# object, so replace it rather than changing it in place)
+phase_heads = frozenset(["v", "c"])
 
 # Initialise lexica
+# (Big lexica can be kept in a database file instead -- See
+# lexicon.file_lexicon -- e.g.:
+#   lexicon.FileLexicon("sge.sqlite", rules=lexicon.SgE.get_rules())
+# after `python2 csparser.py export-lexicon SgE sge.sqlite`)
 lexica = [
     lexicon.SgE(),
     lexicon.Mandarin()
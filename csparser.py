@@ -12,15 +12,29 @@ try:
 except ImportError:
     pass
 
+import argparse
 import sys
+import time
 
+import app.batch
+import app.parse_cache
 import app.parser
+import app.server
+import app.stats
+import app.trace
 import config
+import lexicon.file_lexicon
 
 # .,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.
 # Top-level: Figure out what the user wants
-help_text = ("'parse <sentence>' to parse, 'reload' to reload application, "
-             "'exit' to exit")
+help_text = ("'parse <sentence>' to parse, 'profile <sentence>' to time "
+             "and count the steps of a parse, 'forest <sentence>' to show "
+             "every parse as a packed forest, 'expansions' to list how many "
+             "parses each lexical entry expands to, 'trace (events|steps) "
+             "[file]' / 'trace show [n]' / 'trace off' to trace the parser, "
+             "'cache on <file>' / 'cache show' / 'cache clear' / 'cache off' "
+             "to keep parses between runs, "
+             "'reload' to reload application, 'exit' to exit")
 
 
 def main():
@@ -40,6 +54,112 @@ def main():
             display_result(result)
 
 
+# Batch mode: Parse a whole file of sentences, one per line, into JSON records
+def batch_main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="csparser.py batch",
+        description="Parse a file of sentences (one per line) into JSON "
+                    "records (one per line)")
+    arg_parser.add_argument("input", help="input file ('-' for stdin)")
+    arg_parser.add_argument("--out", required=True,
+                            help="output file for the JSON records")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="number of worker processes")
+    arg_parser.add_argument("--chunk-size", type=int, default=64,
+                            help="sentences handed to a worker at a time")
+    arg_parser.add_argument("--engine", choices=["scan", "chart"],
+                            help="parsing engine (default: config.engine)")
+    arg_parser.add_argument("--max-parses", type=int,
+                            help="stop after this many parses per sentence")
+    arg_parser.add_argument("--timeout", type=float,
+                            help="time budget per sentence, in seconds")
+    arg_parser.add_argument("--stats", action="store_true",
+                            help="include timings and counts in each record")
+    arg_parser.add_argument("--cache",
+                            help="SQLite file to keep parses in between "
+                                 "runs (see app.parse_cache)")
+    options = arg_parser.parse_args(args)
+
+    if options.cache is not None:
+        app.parse_cache.start(options.cache)
+
+    if options.input == "-":
+        in_file = sys.stdin
+    else:
+        in_file = open(options.input)
+
+    start_time = time.time()
+    with open(options.out, "w") as out_file:
+        count = app.batch.run_batch(in_file, out_file,
+                                    workers=options.workers,
+                                    chunk_size=options.chunk_size,
+                                    engine=options.engine,
+                                    max_parses=options.max_parses,
+                                    timeout=options.timeout,
+                                    stats=options.stats)
+
+    sys.stderr.write("Parsed {} sentences in {:.2f}s\n"
+                     "".format(count, time.time() - start_time))
+    if app.parse_cache.active is not None:
+        # (Only counts the lookups made in this process)
+        for line in app.parse_cache.active.report():
+            sys.stderr.write(line + "\n")
+
+
+# Server mode: Keep the lexica loaded and parse sentences sent over HTTP
+def serve_main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="csparser.py serve",
+        description="Serve parse requests over HTTP (JSON), on localhost")
+    arg_parser.add_argument("--port", type=int, default=8642)
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="number of worker processes")
+    arg_parser.add_argument("--chunk-size", type=int, default=8,
+                            help="sentences handed to a worker at a time")
+    arg_parser.add_argument("--timeout", type=float,
+                            help="default time budget per request, in "
+                                 "seconds")
+    arg_parser.add_argument("--cache",
+                            help="SQLite file to keep parses in between "
+                                 "runs (see app.parse_cache)")
+    options = arg_parser.parse_args(args)
+
+    if options.cache is not None:
+        app.parse_cache.start(options.cache)
+
+    server = app.server.ParseServer(port=options.port,
+                                    workers=options.workers,
+                                    chunk_size=options.chunk_size,
+                                    timeout=options.timeout)
+    sys.stderr.write("Serving on {}\n".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# Export one of the configured lexica to a database file, for use with
+# lexicon.FileLexicon
+def export_lexicon_main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="csparser.py export-lexicon",
+        description="Write the base lexical items of a configured lexicon "
+                    "to a database file")
+    arg_parser.add_argument("lexicon", help="lexicon ID (e.g., SgE)")
+    arg_parser.add_argument("out", help="database file to write")
+    options = arg_parser.parse_args(args)
+
+    for configured in config.lexica:
+        if configured.id == options.lexicon:
+            count = lexicon.file_lexicon.export_lexicon(configured,
+                                                        options.out)
+            sys.stderr.write("Wrote {} SOs\n".format(count))
+            return
+
+    sys.stderr.write("No lexicon with ID {}\n".format(options.lexicon))
+    sys.exit(1)
+
+
 # Result of executing user's command -- Value need not be a String
 class Result:
     def __init__(self, command, value):
@@ -55,13 +175,45 @@ def command_parse(user_input):
     elif words[0] == "parse":
         # Put the spaces back into the sentence so that the parsing section can
         # handle tokenisation
+        # (The deduplicator counts the duplicate parses it drops, for the
+        # display)
+        deduplicator = app.parser.Deduplicator()
         return Result(
             "parse",
             ################################################
             # Here is the actual call to the Parser module #
             ################################################
-            app.parser.parse_string(" ".join(words[1:]))
+            (app.parser.parse_string(" ".join(words[1:]),
+                                     deduplicator=deduplicator),
+             deduplicator)
+        )
+    elif words[0] == "profile":
+        # Parse as usual, but collect timings and counts along the way
+        stats = app.stats.ParseStats(memory=True)
+        start_time = time.time()
+        parses = list(app.parser.parse_string(" ".join(words[1:]),
+                                              stats=stats))
+        stats.add_time("total", time.time() - start_time)
+        return Result("profile", (parses, stats))
+    elif words[0] == "forest":
+        # Every parse at once, with the constituents they share written out
+        # once
+        return Result("forest",
+                      app.parser.parse_forest(" ".join(words[1:])))
+    elif words[0] == "expansions":
+        return Result(
+            "expansions",
+            [(lexicon.id, lexicon.expansion_report())
+             for lexicon in config.lexica]
         )
+    elif words[0] == "trace":
+        # (File names keep their case)
+        return Result("trace", trace_command(words[1:],
+                                             user_input.split()[2:]))
+    elif words[0] == "cache":
+        # (File names keep their case)
+        return Result("cache", cache_command(words[1:],
+                                             user_input.split()[2:]))
     elif words[0] == "reload":
         # Trash the application modules and re-import them; that should work
         current_modules = list(sys.modules.keys())
@@ -84,6 +236,61 @@ def command_parse(user_input):
         return Result(False, False)
 
 
+# Switch the parse tracer on or off, or show what it has recorded
+def trace_command(words, original_words):
+    if len(words) == 0 or words[0] == "show":
+        tracer = app.trace.active
+        if tracer is None:
+            return ["Tracing is off."]
+        if isinstance(tracer.sink, app.trace.FileSink):
+            tracer.sink.file.flush()
+            return ["Tracing to {}; the records are in that file."
+                    "".format(tracer.sink.path)]
+        count = 50
+        if len(words) > 1 and words[1].isdigit():
+            count = int(words[1])
+        return [app.trace.format_record(record)
+                for record in tracer.sink.recent(count)]
+    elif words[0] == "off":
+        app.trace.stop()
+        return ["Tracing switched off."]
+    elif words[0] == "clear":
+        if app.trace.active is not None:
+            app.trace.active.sink.clear()
+        return ["Trace records cleared."]
+    elif words[0] in app.trace.levels:
+        path = None
+        if len(original_words) > 0:
+            path = original_words[0]
+        app.trace.start(words[0], path)
+        return ["Tracing {} to {}.".format(words[0], path or "memory")]
+    else:
+        return ["Unknown trace option: {}".format(words[0])]
+
+
+# Switch the parse cache on or off, or show how it is doing
+def cache_command(words, original_words):
+    cache = app.parse_cache.active
+    if len(words) == 0 or words[0] == "show":
+        if cache is None:
+            return ["Parse caching is off."]
+        return cache.report()
+    elif words[0] == "off":
+        app.parse_cache.stop()
+        return ["Parse caching switched off."]
+    elif words[0] == "clear":
+        if cache is not None:
+            cache.clear()
+        return ["Parse cache cleared."]
+    elif words[0] == "on":
+        if len(original_words) == 0:
+            return ["Usage: cache on <file>"]
+        app.parse_cache.start(original_words[0])
+        return ["Caching parses in {}.".format(original_words[0])]
+    else:
+        return ["Unknown cache option: {}".format(words[0])]
+
+
 # Do whatever we need to do to the return values and show them to the user
 def display_result(result):
     if result.command is False:
@@ -92,21 +299,60 @@ def display_result(result):
         # No output
         return
     elif result.command == "parse":
-        # Pretty-print a bracket representation of the returned parses
-        if result.value:
-            print()
-            print("Valid parses found:")
-            for parse in result.value:
-                print("-----")
-                print(parse.to_brackets())
-                if config.debug:
-                    print(parse)
-        else:
+        # Pretty-print a bracket representation of the returned parses, as
+        # they come in
+        parses, deduplicator = result.value
+        found = False
+        for parse in parses:
+            if not found:
+                print()
+                print("Valid parses found:")
+                found = True
+            print("-----")
+            print(parse.to_brackets())
+            if config.debug:
+                print(parse)
+
+        if not found:
             print("No valid parses.")
+        if deduplicator.dropped > 0:
+            print("({} duplicate parse(s) dropped.)"
+                  "".format(deduplicator.dropped))
+    elif result.command == "profile":
+        parses, stats = result.value
+        print("{} valid parse(s).".format(len(parses)))
+        for line in stats.report():
+            print(line)
+    elif result.command == "forest":
+        forest = result.value
+        if forest.count() == 0:
+            print("No valid parses.")
+        else:
+            print("{} valid parse(s), in {} packed constituent(s):"
+                  "".format(forest.count(), len(forest.nodes())))
+            print(forest.to_brackets())
+            if config.deduplicate_parses:
+                print("(The forest counts structurally identical parses "
+                      "separately; 'parse' only shows one of each.)")
+    elif result.command == "trace" or result.command == "cache":
+        for line in result.value:
+            print(line)
+    elif result.command == "expansions":
+        for lexicon_id, report in result.value:
+            print("{}:".format(lexicon_id))
+            for line in report:
+                print("  " + line)
     else:
         # Generic result handling
         print("{}: {}".format(result.command, result.value))
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "export-lexicon":
+        export_lexicon_main(sys.argv[2:])
+    else:
+        main()
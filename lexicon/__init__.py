@@ -11,3 +11,5 @@ from lexicon.template import Lexicon
 from lexicon.sg_english import SgE
 # (Singapore) Mandarin lexicon
 from lexicon.mandarin import Mandarin
+# Lexica kept in a database file, for when they get too big for memory
+from lexicon.file_lexicon import FileLexicon
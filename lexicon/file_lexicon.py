@@ -0,0 +1,223 @@
+# Zechy Wong
+# 27 May 2017
+# Code-switching parser
+# ---------------------
+# File-backed lexicon
+# - For lexica too big to keep in memory: The base lexical items live in an
+#   SQLite database (one row per SO, indexed by token), and are only read in
+#   when a token is looked up
+# - Expansions go through the usual bounded lookup cache, so only the
+#   tokens in recent use stay resident
+# - build_database()/export_lexicon() write the database, from a dictionary
+#   of base lexical items or from an existing (in-memory) lexicon
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from lexicon.template import Lexicon
+from app.syntactic_object import SO
+
+# Bump this whenever the database layout changes
+database_version = 1
+
+
+def native_strings(value):
+    """
+    JSON and SQLite hand back unicode strings, but (under Python 2) the rest
+    of the parser works with UTF-8 byte strings -- Convert everything back
+    :param value:
+    :return:
+    """
+    if str is bytes:
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        if isinstance(value, list):
+            return [native_strings(item) for item in value]
+        if isinstance(value, dict):
+            return dict((native_strings(key), native_strings(item))
+                        for key, item in value.items())
+    return value
+
+
+def text(value):
+    """
+    The other way round: SQLite wants unicode rather than (non-ASCII) byte
+    strings
+    :param value:
+    :return:
+    """
+    if str is bytes and isinstance(value, str):
+        return value.decode("utf-8")
+    return value
+
+
+def build_database(path, entries, lexicon_id):
+    """
+    Write a lexicon database from scratch
+    :param path:
+    :param entries: Dictionary of base lexical items, as returned by the
+        in-memory lexica's get_lexicon()
+    :param lexicon_id:
+    :return: The number of SOs written
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    connection = sqlite3.connect(path)
+    digest = hashlib.sha1()
+    try:
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, "
+                           "value TEXT)")
+        connection.execute("CREATE TABLE entries ("
+                           "token TEXT NOT NULL, "
+                           "position INTEGER NOT NULL, "
+                           "words INTEGER NOT NULL, "
+                           "so TEXT NOT NULL, "
+                           "PRIMARY KEY (token, position))")
+        # Multi-word tokens, for the tokeniser
+        connection.execute("CREATE INDEX entries_words ON entries (words)")
+
+        rows = []
+        for token in sorted(entries):
+            for position, so in enumerate(entries[token]):
+                so_json = json.dumps(so.to_dict(), sort_keys=True)
+                rows.append((text(token), position, len(token.split()),
+                             so_json))
+                digest.update(token)
+                digest.update(so_json)
+        connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                               rows)
+        count = len(rows)
+
+        connection.executemany("INSERT INTO meta VALUES (?, ?)",
+                               [("version", str(database_version)),
+                                ("id", text(lexicon_id)),
+                                ("checksum", digest.hexdigest())])
+        connection.commit()
+    finally:
+        connection.close()
+
+    return count
+
+
+def export_lexicon(lexicon, path):
+    """
+    Write the base lexical items of an existing lexicon to a database
+    :param lexicon:
+    :param path:
+    :return: The number of SOs written
+    """
+    return build_database(path, lexicon.lexicon, lexicon.id)
+
+
+class EntryStore:
+    """
+    Read-only, dictionary-like view of the base lexical items in a lexicon
+    database: token -> list of (fresh, writable) SOs
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Connections can't be shared with forked worker processes, so each
+        # process opens its own; threads share it behind a lock
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.Lock()
+
+    def query(self, statement, parameters=()):
+        with self.lock:
+            if self.connection_pid != os.getpid():
+                self.connection = sqlite3.connect(self.path,
+                                                  check_same_thread=False)
+                self.connection_pid = os.getpid()
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def meta(self, key):
+        try:
+            rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        except sqlite3.DatabaseError:
+            # Not one of ours
+            return None
+        if len(rows) == 0:
+            return None
+        return native_strings(rows[0][0])
+
+    def __contains__(self, token):
+        return len(self.query("SELECT 1 FROM entries WHERE token = ? "
+                              "LIMIT 1", (text(token),))) > 0
+
+    def __getitem__(self, token):
+        rows = self.query("SELECT so FROM entries WHERE token = ? "
+                          "ORDER BY position", (text(token),))
+        if len(rows) == 0:
+            raise KeyError(token)
+        return [SO.from_dict(native_strings(json.loads(row[0])))
+                for row in rows]
+
+    def get(self, token, default=None):
+        try:
+            return self[token]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        for row in self.query("SELECT DISTINCT token FROM entries "
+                              "ORDER BY token"):
+            yield native_strings(row[0])
+
+    def __len__(self):
+        return self.query("SELECT COUNT(DISTINCT token) FROM entries")[0][0]
+
+    def multiword_tokens(self):
+        return [native_strings(row[0])
+                for row in self.query("SELECT DISTINCT token FROM entries "
+                                      "WHERE words > 1")]
+
+
+class FileLexicon(Lexicon):
+    def __init__(self, path, rules=None, lexicon_id=None):
+        """
+        A lexicon whose base lexical items are read from a database (see
+        build_database()) as they are needed
+        :param path:
+        :param rules: Rule list for the language, e.g. SgE.get_rules()
+        :param lexicon_id: Default: The ID the database was built with
+        """
+        Lexicon.__init__(self)
+
+        if not os.path.isfile(path):
+            raise IOError("No lexicon database at {}".format(path))
+
+        self.lexicon = EntryStore(path)
+        if self.lexicon.meta("version") != str(database_version):
+            raise ValueError("{} is not a lexicon database (version {})"
+                             "".format(path, database_version))
+
+        self.id = lexicon_id or self.lexicon.meta("id")
+        self.rules = rules or []
+
+        # Not compile()d, and not cached on disk: That would mean having
+        # every entry in memory at once.  Lookups go through the (bounded)
+        # lookup cache instead.
+
+    def fingerprint(self):
+        """
+        As for Lexicon.fingerprint(), but taking the contents of the
+        database into account as well
+        :return:
+        """
+        base_fingerprint = Lexicon.fingerprint(self)
+        if base_fingerprint is None:
+            return None
+        digest = hashlib.sha1(base_fingerprint.encode("utf-8"))
+        digest.update(self.lexicon.meta("checksum") or "")
+        return digest.hexdigest()
+
+    def multiword_tokens(self):
+        return self.lexicon.multiword_tokens()
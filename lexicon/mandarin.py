@@ -21,16 +21,10 @@ class Mandarin(Lexicon):
 
         # Put all the data-heavy bits further down for readability
         self.rules = self.get_rules()
-        self.lexicon = self.get_lexicon()
 
-    def apply_rules(self, token_parse_list):
-        """
-        Takes a list of parses, where each parse is a list of SOs.
-        Run it through the rule system and return an enriched list of parses.
-        :param token_parse_list:
-        :return:
-        """
-        return token_parse_list
+        # Expand every entry up front (or load the expansions from the
+        # on-disk cache)
+        self.load_compiled(self.get_lexicon)
 
     # .,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.
     # Private data functions
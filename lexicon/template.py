@@ -4,30 +4,40 @@
 # Code-switching parser
 # ---------------------
 # Class template for lexica
+# - Compiled lexica are cached on disk (see load_compiled()), keyed by a hash
+#   of the source code that goes into them
 
-import copy
+import hashlib
+import inspect
+import os
+import sys
+import tempfile
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
-# Decorator
-def warn_undefined(func):
-    """
-    Lets the user know that some lexicon module failed to re-define one of the
-    core API functions
-    """
-
-    def wrapped(self, *args, **kwargs):
-        print("Lexicon [{0}] did not define API method: {1}"
-              .format(self.__class__.__name__,
-                      func.__name__))
-        return func(self, *args, **kwargs)
-
-    return wrapped
+import app.subcat
+import app.syntactic_object
+from app.cache import LRUCache
 
 
 class Lexicon:
     # Label for unpronounced items (e.g., functional heads)
     null_label = "∅"
 
+    # How many tokens' worth of expanded SOs to keep around for each lexicon
+    lookup_cache_size = 4096
+
+    # Where compiled lexica are kept between runs (None to always build them
+    # from scratch)
+    cache_dir = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "lexicon_cache")
+    # Bump this whenever the layout of the cached data changes
+    cache_version = 1
+
     def __init__(self):
         # We expect all lexica to have a set of basic rules and a set of base
         # lexical items.
@@ -41,55 +51,310 @@ class Lexicon:
         # Identifier string for the lexicon
         self.id = "Default"
 
-        # Rule system
+        # Rule system: A list of [criteria list, rule function] pairs (see
+        # apply_rules())
         self.rules = []
+        # The rules, indexed by the category sequences they apply to -- Built
+        # from self.rules when first needed (and again if it is replaced)
+        self.rule_index = None
+        self.wildcard_rules = None
+        self.indexed_rules = None
 
         # Base lexical items
         self.lexicon = {}
 
-    @warn_undefined
-    def apply_rules(self, token_parse_list):
-        """
-        Takes a list of parses, where each parse is a list of SOs.
-        Run it through the rule system and return an enriched list of parses.
+        # Tokens that have already been looked up, mapped to their (shared,
+        # frozen) expansions
+        self.lookup_cache = LRUCache(self.lookup_cache_size)
 
-        This we leave to individual lexica to define.
+        # Once compile()d, every token mapped to its final expansion, and the
+        # number of parses each one expanded to
+        self.compiled = None
+        self.expansion_counts = {}
 
+    def apply_rules(self, token_parse_list):
+        """
+        Takes a list of parses, where each parse is a tuple of SOs.
+        Run it through the rule system and return an enriched list of parses:
+        For each parse, the output of every rule that matches it, then the
+        parse itself.
+
+        Each rule is a [criteria list, rule function] pair.  A rule matches a
+        parse of the same length if each SO in the parse subcat_matches the
+        corresponding criteria.  The rule function is handed the parse
+        itself, whose SOs are shared (with the lexicon, and with the other
+        rules), and should return a new parse, copy()ing any SOs it wants to
+        change -- Or False for a no-op.
         :param token_parse_list:
         :return:
         """
-        return token_parse_list
+        if self.indexed_rules is not self.rules:
+            self.index_rules()
+
+        enriched_parse_list = []
+        seen = set()
+        for token_parse in token_parse_list:
+            for _, matchers, rule in self.matching_rules(token_parse):
+                matched = True
+                for idx in range(len(matchers)):
+                    if not matchers[idx].matches(token_parse[idx]):
+                        matched = False
+                        break
+                if not matched:
+                    continue
+
+                new_parse = rule(token_parse)
+                if new_parse is not False:
+                    new_parse = tuple(new_parse)
+                    if new_parse not in seen:
+                        seen.add(new_parse)
+                        enriched_parse_list.append(new_parse)
+
+            # Add the original parse
+            if token_parse not in seen:
+                seen.add(token_parse)
+                enriched_parse_list.append(token_parse)
+
+        return enriched_parse_list
+
+    def index_rules(self):
+        """
+        Index self.rules by the sequence of categories each one applies to,
+        so that a parse only has to be checked against the rules that could
+        possibly match it
+        :return:
+        """
+        self.rule_index = {}
+        # Rules with criteria that don't specify a category (and so match
+        # any category)
+        self.wildcard_rules = []
+
+        for position, (criteria, rule) in enumerate(self.rules):
+            matchers = tuple(app.subcat.compile_criteria(criterion.freeze())
+                             for criterion in criteria)
+            key = tuple(criterion.category for criterion in criteria)
+            if None in key:
+                self.wildcard_rules.append((position, matchers, rule))
+            else:
+                self.rule_index.setdefault(key, []).append((position,
+                                                            matchers, rule))
+        self.indexed_rules = self.rules
+
+    def matching_rules(self, token_parse):
+        """
+        The rules that could apply to the given parse, as (position,
+        matchers, rule function) tuples in their original order
+        :param token_parse:
+        :return:
+        """
+        key = tuple(so.category for so in token_parse)
+        if None in key:
+            # SOs with no category match any criteria
+            candidates = [entry for rule_key, entries in self.rule_index.items()
+                          if len(rule_key) == len(key)
+                          for entry in entries]
+        else:
+            candidates = list(self.rule_index.get(key, []))
+        candidates.extend(entry for entry in self.wildcard_rules
+                          if len(entry[1]) == len(key))
+
+        candidates.sort(key=lambda entry: entry[0])
+        return candidates
 
     # .,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.-'~'-.,__,.
     # Common utility functions
 
+    def compile(self):
+        """
+        Expands every entry in the lexicon ahead of time: The rule outputs
+        and generated SOs only depend on the lexical entry, not on the
+        sentence, so after this lookup_token() is a single table read.
+        Should be called again if the lexicon is changed afterwards.
+        Returns a dictionary of the number of parses each token expanded to,
+        so that entries which blow up can be spotted
+        :return:
+        """
+        self.compiled = {}
+        self.expansion_counts = {}
+        for token in self.lexicon:
+            self.compiled[token] = self.expand_token(token)
+            self.expansion_counts[token] = len(self.compiled[token])
+
+        self.lookup_cache.clear()
+        return self.expansion_counts
+
+    def fingerprint(self):
+        """
+        A hash of everything that goes into this lexicon's compiled form: The
+        source code of its class (and the classes it inherits from) and of
+        the SO classes.  If any of it changes, cached copies are stale.
+        Returns None if some of that source can't be found (e.g., for a
+        class defined interactively), in which case nothing should be cached
+        :return:
+        """
+        modules = []
+        for cls in inspect.getmro(self.__class__):
+            module = sys.modules[cls.__module__]
+            if module not in modules:
+                modules.append(module)
+        modules += [app.syntactic_object, app.subcat]
+
+        digest = hashlib.sha1(str(self.cache_version).encode("utf-8"))
+        for module in modules:
+            try:
+                source_path = inspect.getsourcefile(module)
+            except TypeError:
+                # Built-in module, or __main__ in an interactive session
+                source_path = None
+            if source_path is None:
+                return None
+            with open(source_path, "rb") as source_file:
+                digest.update(source_file.read())
+        return digest.hexdigest()
+
+    def cache_path(self):
+        return os.path.join(self.cache_dir, "{}.pickle".format(self.id))
+
+    def load_compiled(self, get_lexicon):
+        """
+        Sets up the base lexical items and their compiled expansions: From
+        the on-disk cache if it has an up-to-date copy, or else by calling
+        get_lexicon() and compile(), and caching the result.
+        (No cache is read or written if cache_dir is None, or if there is no
+        fingerprint())
+        Returns True if the cached copy was used
+        :param get_lexicon: Returns the dictionary of base lexical items
+        :return:
+        """
+        fingerprint = None
+        if self.cache_dir is not None:
+            fingerprint = self.fingerprint()
+
+        cached = self.read_cache(fingerprint)
+        if cached is not None:
+            self.lexicon, self.compiled, self.expansion_counts = cached
+            self.lookup_cache.clear()
+            return True
+
+        self.lexicon = get_lexicon()
+        self.compile()
+        self.write_cache(fingerprint)
+        return False
+
+    def read_cache(self, fingerprint):
+        """
+        Returns the cached (lexicon, compiled, expansion counts), or None if
+        there is no cached copy for the given fingerprint
+        :param fingerprint:
+        :return:
+        """
+        if self.cache_dir is None or fingerprint is None:
+            return None
+
+        try:
+            with open(self.cache_path(), "rb") as cache_file:
+                cached = pickle.loads(cache_file.read())
+            if (cached["version"] != self.cache_version or
+                    cached["fingerprint"] != fingerprint):
+                return None
+            return (cached["lexicon"], cached["compiled"],
+                    cached["expansion_counts"])
+        except Exception:
+            # Missing, unreadable or from some incompatible version: Just
+            # build the lexicon again
+            return None
+
+    def write_cache(self, fingerprint):
+        """
+        Save the base lexical items and their compiled expansions.
+        The file is written under a temporary name first, so nobody ever
+        reads a half-written cache
+        :param fingerprint:
+        :return:
+        """
+        if self.cache_dir is None or fingerprint is None:
+            return
+
+        data = pickle.dumps({"version": self.cache_version,
+                             "fingerprint": fingerprint,
+                             "lexicon": self.lexicon,
+                             "compiled": self.compiled,
+                             "expansion_counts": self.expansion_counts},
+                            pickle.HIGHEST_PROTOCOL)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            handle, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(handle, "wb") as temp_file:
+                temp_file.write(data)
+            os.rename(temp_path, self.cache_path())
+        except (IOError, OSError):
+            # The cache is only an optimisation
+            pass
+
+    def expansion_report(self):
+        """
+        Lists the tokens in this lexicon with the number of parses each one
+        expands to, largest first
+        :return:
+        """
+        return ["{}: {}".format(token, count)
+                for token, count in sorted(self.expansion_counts.items(),
+                                           key=lambda item: (-item[1],
+                                                             item[0]))]
+
+    def multiword_tokens(self):
+        """
+        Lists the tokens in this lexicon that are made up of more than one
+        word, so that the tokeniser knows to look out for them
+        :return:
+        """
+        return [token for token in self.lexicon if " " in token]
+
     def lookup_token(self, token):
         """
         Given some raw input string from the user, should attempt to return
         any exact matches for a *single* token after running it through the
-        rule system (recursively if necessary) -- As a list of lists of SOs
+        rule system (recursively if necessary) -- As a list of tuples of SOs
         Or False if there are no applicable matches
+        The returned list is shared between lookups and must not be changed;
+        the SOs in it are frozen (copy() any that need changing)
+        :param token:
+        :return:
+        """
+        if self.compiled is not None:
+            return self.compiled.get(token, False)
+
+        token_parse_list = self.lookup_cache.get(token)
+        if token_parse_list is None:
+            token_parse_list = self.expand_token(token)
+            self.lookup_cache.put(token, token_parse_list)
+
+        return token_parse_list
+
+    def expand_token(self, token):
+        """
+        Does the actual work for lookup_token(): Finds the base SOs for the
+        token, runs them through the rule system and generates any
+        functional heads they call for.
+        Returns a list of tuples of frozen SOs, or False if the token is not
+        in this lexicon
         :param token:
         :return:
         """
         # In the lexicon, each token maps to a 1-d list of its possible base SO
         # representations.
         # When we return it, we want to expand this to a 2-d list:
-        # A list of all possible parses, where each parse is a list of SOs
+        # A list of all possible parses, where each parse is a tuple of SOs
         # (including functional heads and the like which might be generated
         # from the base SO).
 
         # Get base SO
         if token in self.lexicon:
-
-            token_parse_list = []
-
-            # Create a copy of the lexical entry so that we don't accidentally
-            # mess up the actual lexicon
-            copied_entry = copy.deepcopy(self.lexicon[token])
-
-            for base_so in copied_entry:
-                token_parse_list.append([base_so])
+            # Nothing below changes an SO in place (anything that needs to
+            # change is copied first), so the lexical entries themselves can
+            # go in
+            token_parse_list = [(base_so,) for base_so in self.lexicon[token]]
         else:
             return False
 
@@ -101,18 +366,43 @@ class Lexicon:
         token_parse_list = self.generate_items(token_parse_list)
 
         # Mark every SO with the ID of this lexicon (unless it is
-        # phonologically null)
+        # phonologically null), then freeze it so it can be shared.
+        # Identical parses (e.g., from rules that give back something that
+        # was already there) are only listed once.
+        frozen_parse_list = []
+        seen = set()
         for token_parse in token_parse_list:
-            for so in token_parse:
-                if so.label != Lexicon.null_label:
-                    so.lexicon = self.id
+            frozen_parse = tuple(self.mark_lexicon(so) for so in token_parse)
+            if frozen_parse not in seen:
+                seen.add(frozen_parse)
+                frozen_parse_list.append(frozen_parse)
 
-        return token_parse_list
+        return frozen_parse_list
+
+    def mark_lexicon(self, so):
+        """
+        Returns the frozen version of the SO, marked as coming from this
+        lexicon unless it is phonologically null
+        :param so:
+        :return:
+        """
+        if so.label == Lexicon.null_label or so.lexicon == self.id:
+            return so.freeze()
+
+        if so.frozen:
+            return so.replace(lexicon=self.id)
+
+        marked = so.copy()
+        marked.lexicon = self.id
+        return marked.freeze()
 
     def generate_items(self, token_parse_list):
         """
-        Takes a list of parses, where each parse is a list of SOs.
+        Takes a list of parses, where each parse is a tuple of SOs.
         Recursively generate sub-SOs that are specified in the base SOs
+        The SOs in the parses are left alone: Generated SOs are shared with
+        the SOs that generate them, and SOs that have generated things are
+        replaced by copies
         :param token_parse_list:
         :return:
         """
@@ -126,13 +416,13 @@ class Lexicon:
             # Loop through the SOs of this parse, generating new entries where
             # specified
             enriched_parse = []
-            for idx in range(len(token_parse)):
+            for so in token_parse:
                 # Check the 'generate' attribute of each SO in this parse
-                if len(token_parse[idx].generate) > 0:
+                if len(so.generate) > 0:
                     # Queue up things to be generated to the left and the right
                     generate_left = []
                     generate_right = []
-                    for generate_params in token_parse[idx].generate:
+                    for generate_params in so.generate:
                         if generate_params[0] == "left":
                             generate_left.append(generate_params[1])
                         elif generate_params[0] == "right":
@@ -146,15 +436,20 @@ class Lexicon:
                     # this parse by extending the left/right queues in
                     enriched_parse += generate_left
 
-                    token_parse[idx].generate = []
-                    enriched_parse.append(token_parse[idx])
+                    # The SO itself, minus its 'generate' attribute
+                    if so.frozen:
+                        so = so.replace(generate=())
+                    else:
+                        so = so.copy()
+                        so.generate = []
+                    enriched_parse.append(so)
 
                     enriched_parse += generate_right
                 else:
-                    enriched_parse.append(token_parse[idx])
+                    enriched_parse.append(so)
 
             # Put it on the final parse list
-            enriched_parse_list.append(enriched_parse)
+            enriched_parse_list.append(tuple(enriched_parse))
 
         # Do we need to recurse?
         if generate_again: